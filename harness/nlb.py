@@ -0,0 +1,776 @@
+"""
+Local end-to-end harness for the control plane of the NLB.
+
+The generator (user_data/nlb/nginx.py, one per NLB instance) and the
+nlb-ecs and nlb-asg-lch Lambdas run in-process, against an in-memory fake
+of the ECS, EC2, AutoScaling, SSM, Route53 and S3 APIs. Every instance
+boots as on EC2 (write_boot_config(), then Daemon.boot()), and runs the
+iterations of the daemon (Daemon.step()), each with its own folder for
+the nginx configuration, the spool folder and the topology cache. Only
+validating and reloading nginx are left out.
+
+Scripted scenarios change the fake cluster, after which the harness keeps
+time: every poll interval the instances take a step, events are delivered
+to the nlb-ecs Lambda once the SQS batching window closed, and (with a
+central topology) the Lambda does its scheduled full publish. This goes
+on till every instance has rendered what the cluster runs, and DNS points
+to exactly the instances in service.
+
+Per scenario it reports the (simulated) time to converge, the nginx
+reloads and the API calls made. The latency of the AWS APIs (including
+RunCommand) and the DNS TTL are not simulated; they add to this time.
+
+Usage:
+  python3 harness/nlb.py [--scenario deploy-storm] [--mode central] [--verbose]
+"""
+
+import argparse
+import base64
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+from collections import (
+    Counter,
+    defaultdict,
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "user_data", "nlb"))
+
+# The ECS and EC2 fakes of the benchmark; they page and count API calls as AWS would.
+import snapshot  # noqa: E402
+
+CLUSTER = "harness"
+AUTO_SCALING_GROUP_NAME = "harness-nlb"
+TOPOLOGY_BUCKET = "harness-topology"
+TOPOLOGY_KEY = "topology.json"
+HOSTED_ZONE_ID = "ZPUBLIC"
+PRIVATE_HOSTED_ZONE_ID = "ZPRIVATE"
+DOMAIN_NAME = "nlb.openttd.org"
+PRIVATE_DOMAIN_NAME = "nlb.openttd.internal"
+
+# How many ECS events fit in a single SQS batch to the nlb-ecs Lambda, and
+# how long SQS collects them (ecs_event_window of the NlbStack).
+SQS_BATCH_SIZE = 1000
+SQS_BATCH_WINDOW = 10
+# As the NlbStack and nginx.py use them by default.
+POLL_INTERVAL = 0.5
+RESYNC_INTERVAL = 300
+TOPOLOGY_RESYNC_INTERVAL = 300
+# Simulated seconds before a scenario is considered stuck.
+MAX_SECONDS = 900
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    # nginx.py and the nlb-ecs Lambda import discovery; they have to find this instance.
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_modules():
+    # The Lambdas create their clients on import; these are replaced by
+    # fakes right after, but boto3 wants a region to create them.
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-central-1")
+
+    discovery = load_module("discovery", os.path.join(ROOT, "lambdas", "discovery-layer", "python", "discovery.py"))
+    return (
+        load_module("nginx", os.path.join(ROOT, "user_data", "nlb", "nginx.py")),
+        discovery,
+        load_module("nlb_ecs", os.path.join(ROOT, "lambdas", "nlb-ecs", "index.py")),
+        load_module("nlb_asg_lch", os.path.join(ROOT, "lambdas", "nlb-asg-lch", "index.py")),
+    )
+
+
+class SimulatedTime:
+    """Stands in for the time module of nginx.py; time only passes when the harness says so."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.epoch = time.time()
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.epoch + self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class WorldSnapshot:
+    """The cluster of the world, as a snapshot (see snapshot.py); always the current state."""
+
+    def __init__(self, world):
+        self.world = world
+
+    def __getitem__(self, key):
+        world = self.world
+        if key == "services":
+            return [{"serviceName": name, "tags": tags} for name, tags in world.services.items()]
+        if key == "tasks":
+            # As list_tasks() does by default, only tasks that are not stopped.
+            return [dict(task) for task in world.tasks.values() if task["lastStatus"] != "STOPPED"]
+        if key == "containerInstances":
+            return [
+                {"containerInstanceArn": arn, "ec2InstanceId": instance_id, "status": "ACTIVE"}
+                for arn, instance_id in world.container_instances.items()
+            ]
+        if key == "instances":
+            return [world.describe_instance(instance_id) for instance_id in world.ec2]
+        raise KeyError(key)
+
+
+class FakeECSClient(snapshot.SnapshotECSClient):
+    def __init__(self, world):
+        super().__init__(WorldSnapshot(world))
+        self.calls = world.calls
+
+
+class FakeEC2Client(snapshot.SnapshotEC2Client):
+    def __init__(self, world):
+        super().__init__(WorldSnapshot(world))
+        self.calls = world.calls
+
+    def describe_instances(self, InstanceIds, **kwargs):
+        self.calls["describe_instances"] += 1
+        return {"Reservations": self._describe_instances(InstanceIds)}
+
+
+class FakeWaiter:
+    def __init__(self, world):
+        self.world = world
+
+    def wait(self, Id, **kwargs):
+        # Changes are INSYNC right away.
+        self.world.count("get_change")
+
+
+class FakeResponse:
+    def __init__(self, status, data):
+        self.status = status
+        self.data = data
+
+
+class FakeHttp:
+    """Stands in for the urllib3 pool the nlb-asg-lch Lambda probes instances with."""
+
+    def __init__(self, world):
+        self.world = world
+
+    def request(self, method, url, **kwargs):
+        ip, _, path = url[len("http://") :].partition("/")
+
+        instance = self.world.nlb_instance_by_ip(ip)
+        if instance is None or not instance.alive:
+            import urllib3
+
+            raise urllib3.exceptions.NewConnectionError(None, f"{ip} is not reachable")
+
+        # As nginx.conf serves them: the files written by nginx.py.
+        filename = {"readyz": instance.ready_file, "connections": instance.connections_file}.get(path)
+        if filename is None or not os.path.exists(filename):
+            return FakeResponse(404, b"")
+        with open(filename, "rb") as fp:
+            return FakeResponse(200, fp.read())
+
+
+class FakeClient:
+    """The other AWS APIs the data plane uses, answered from the world."""
+
+    class exceptions:
+        class NoSuchKey(ClientError):
+            pass
+
+    def __init__(self, world):
+        self.world = world
+        # Used by the paginators.
+        self.calls = world.calls
+
+    def get_paginator(self, name):
+        if name == "list_command_invocations":
+            return snapshot.SnapshotPaginator(
+                self, name, lambda CommandId, **kwargs: self.world.commands[CommandId], "CommandInvocations"
+            )
+        raise NotImplementedError(name)
+
+    # AutoScaling
+
+    def describe_auto_scaling_groups(self, **kwargs):
+        self.world.count("describe_auto_scaling_groups")
+        return {
+            "AutoScalingGroups": [
+                {
+                    "Instances": [
+                        {"InstanceId": instance_id, "LifecycleState": state}
+                        for instance_id, state in self.world.asg_instances.items()
+                    ]
+                }
+            ]
+        }
+
+    def complete_lifecycle_action(self, LifecycleActionResult, LifecycleActionToken, **kwargs):
+        self.world.count("complete_lifecycle_action")
+        self.world.complete_lifecycle_action(LifecycleActionToken, LifecycleActionResult)
+
+    # SSM
+
+    def send_command(self, InstanceIds, Parameters, **kwargs):
+        self.world.count("send_command")
+        return {"Command": {"CommandId": self.world.send_command(InstanceIds, Parameters["commands"])}}
+
+    # Route53
+
+    def change_resource_record_sets(self, HostedZoneId, ChangeBatch):
+        self.world.count("change_resource_record_sets")
+        with self.world.lock:
+            for change in ChangeBatch["Changes"]:
+                record = change["ResourceRecordSet"]
+                self.world.records[(HostedZoneId, record["Name"], record["Type"])] = {
+                    value["Value"] for value in record["ResourceRecords"]
+                }
+        return {"ChangeInfo": {"Id": f"/change/{uuid.uuid4()}"}}
+
+    def get_waiter(self, name):
+        return FakeWaiter(self.world)
+
+    # S3
+
+    def get_object(self, Bucket, Key):
+        self.world.count("get_object")
+        if (Bucket, Key) not in self.world.objects:
+            raise self.exceptions.NoSuchKey({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        body, _ = self.world.objects[(Bucket, Key)]
+        return {"Body": io.BytesIO(body)}
+
+    def head_object(self, Bucket, Key):
+        self.world.count("head_object")
+        if (Bucket, Key) not in self.world.objects:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        _, metadata = self.world.objects[(Bucket, Key)]
+        return {"Metadata": metadata}
+
+    def put_object(self, Bucket, Key, Body, Metadata=None, **kwargs):
+        self.world.count("put_object")
+        self.world.objects[(Bucket, Key)] = (Body, Metadata or {})
+
+
+class FakeContext:
+    def __init__(self, timeout):
+        self.aws_request_id = str(uuid.uuid4())
+        self.deadline = time.monotonic() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+class NlbInstance:
+    """An NLB instance; boots, and runs the daemon of nginx.py one iteration per step()."""
+
+    def __init__(self, harness, instance_id, private_ip):
+        self.harness = harness
+        self.instance_id = instance_id
+        self.private_ip = private_ip
+        self.alive = True
+
+        # What is /etc/nginx/nlb.d, /var/spool/nlb and /var/lib/nlb on EC2.
+        self.folder = tempfile.mkdtemp(prefix=f"nlb-{instance_id}-")
+        self.config_folder = os.path.join(self.folder, "nlb.d")
+        self.spool_folder = os.path.join(self.folder, "spool")
+        os.makedirs(self.config_folder)
+        self.ready_file = os.path.join(self.folder, "ready.json")
+        self.connections_file = os.path.join(self.folder, "connections.json")
+        self.topology_cache = os.path.join(self.folder, "topology.json")
+
+        nginx = harness.nginx
+        topology_url = f"s3://{TOPOLOGY_BUCKET}/{TOPOLOGY_KEY}"
+        if harness.central:
+            self.topology_url, self.mirror_url = topology_url, None
+            topology = nginx.ArtifactTopology(topology_url)
+        else:
+            self.topology_url, self.mirror_url = None, topology_url
+            topology = nginx.Topology(CLUSTER)
+        self.daemon = nginx.Daemon(topology, self.spool_folder, RESYNC_INTERVAL, self.mirror_url)
+
+    @contextlib.contextmanager
+    def activate(self):
+        """Point nginx.py to the files of this instance."""
+        nginx = self.harness.nginx
+        nginx.READY_FILE = self.ready_file
+        nginx.CONNECTIONS_FILE = self.connections_file
+        nginx.TOPOLOGY_CACHE = self.topology_cache
+        nginx.reload_nginx = lambda: self.harness.reloads.update([self.instance_id])
+
+        cwd = os.getcwd()
+        os.chdir(self.config_folder)
+        try:
+            yield
+        finally:
+            os.chdir(cwd)
+
+    def boot(self):
+        with self.activate():
+            self.harness.nginx.write_boot_config(CLUSTER, self.topology_url, self.mirror_url)
+            self.daemon.boot()
+
+    def step(self):
+        with self.activate():
+            self.daemon.step()
+
+    def served(self):
+        """What nginx serves: the upstreams of the rendered configuration."""
+        served = {}
+        filename = os.path.join(self.config_folder, "nlb.conf")
+        if not os.path.exists(filename):
+            return served
+
+        listener = None
+        with open(filename, "r") as fp:
+            for line in fp:
+                match = re.match(r"\s*upstream (tcp|udp)(\d+) \{", line)
+                if match:
+                    listener = (match.group(1), int(match.group(2)))
+                    served[listener] = set()
+                    continue
+
+                match = re.match(r"\s*server ([0-9.]+):(\d+)", line)
+                if match and listener is not None:
+                    served[listener].add((match.group(1), int(match.group(2))))
+                elif line.strip() == "}":
+                    listener = None
+        return served
+
+    def destroy(self):
+        self.alive = False
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+class World:
+    """The fake AWS account: an ECS cluster, and the NLB ASG with its DNS records."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = Counter()
+
+        self.services = {}  # service-name -> tags
+        self.tasks = {}  # task-arn -> task
+        self.container_instances = {}  # container-instance-arn -> ec2-instance-id
+        self.ec2 = {}  # instance-id -> addresses
+        self.asg_instances = {}  # instance-id -> lifecycle-state
+        self.nlb_instances = {}  # instance-id -> NlbInstance
+        self.records = {}  # (zone, name, type) -> set of values
+        self.objects = {}  # (bucket, key) -> (body, metadata)
+        self.commands = {}  # command-id -> invocations
+        self.events = []  # ECS events waiting in SQS
+
+        self.next_ip = 1
+        self.next_port = 32768
+        self.ports = defaultdict(int)
+
+    def count(self, name):
+        with self.lock:
+            self.calls[name] += 1
+
+    def add_ec2(self):
+        instance_id = f"i-{uuid.uuid4().hex[:17]}"
+        ip = f"10.0.{self.next_ip // 256}.{self.next_ip % 256}"
+        self.ec2[instance_id] = {
+            "PrivateIpAddress": ip,
+            "PublicIpAddress": f"198.51.{self.next_ip // 256}.{self.next_ip % 256}",
+            "Ipv6Address": f"2001:db8::{self.next_ip:x}",
+        }
+        self.next_ip += 1
+        return instance_id
+
+    def describe_instance(self, instance_id):
+        return {
+            "InstanceId": instance_id,
+            "PrivateIpAddress": self.ec2[instance_id]["PrivateIpAddress"],
+            "PublicIpAddress": self.ec2[instance_id]["PublicIpAddress"],
+            "NetworkInterfaces": [{"Ipv6Addresses": [{"Ipv6Address": self.ec2[instance_id]["Ipv6Address"]}]}],
+        }
+
+    def nlb_instance_by_ip(self, ip):
+        for instance in self.nlb_instances.values():
+            if instance.private_ip == ip:
+                return instance
+        return None
+
+    # ECS
+
+    def add_container_instance(self):
+        arn = f"arn:aws:ecs:eu-central-1:0:container-instance/{CLUSTER}/{uuid.uuid4().hex}"
+        self.container_instances[arn] = self.add_ec2()
+        return arn
+
+    def add_service(self, name, protocol, port):
+        self.services[name] = [
+            {"key": "NLB-protocol", "value": protocol},
+            {"key": "NLB-port", "value": str(port)},
+        ]
+        self.ports[name] = port
+
+    def emit(self, task):
+        self.events.append({"detail": dict(task)})
+
+    def start_task(self, service_name):
+        container_instance_arn = list(self.container_instances)[len(self.tasks) % len(self.container_instances)]
+        task = {
+            "taskArn": f"arn:aws:ecs:eu-central-1:0:task/{CLUSTER}/{uuid.uuid4().hex}",
+            "group": f"service:{service_name}",
+            "version": 1,
+            "lastStatus": "RUNNING",
+            "desiredStatus": "RUNNING",
+            "containerInstanceArn": container_instance_arn,
+            "containers": [
+                {"networkBindings": [{"containerPort": self.ports[service_name], "hostPort": self.next_port}]}
+            ],
+        }
+        self.next_port += 1
+        self.tasks[task["taskArn"]] = task
+        self.emit(task)
+        return task["taskArn"]
+
+    def stop_task(self, task_arn):
+        task = self.tasks[task_arn]
+        task.update(version=task["version"] + 1, lastStatus="STOPPED", desiredStatus="STOPPED")
+        self.emit(task)
+
+    def expected_load_balancer(self):
+        """What every NLB instance should serve, straight from the cluster."""
+        load_balancer = defaultdict(set)
+        for task in self.tasks.values():
+            if task["lastStatus"] != "RUNNING":
+                continue
+
+            service_name = task["group"][len("service:") :]
+            tags = {tag["key"]: tag["value"] for tag in self.services[service_name]}
+            listener = (tags["NLB-protocol"], int(tags["NLB-port"]))
+            host_ip = self.ec2[self.container_instances[task["containerInstanceArn"]]]["PrivateIpAddress"]
+            for container in task["containers"]:
+                for binding in container["networkBindings"]:
+                    load_balancer[listener].add((host_ip, binding["hostPort"]))
+        return dict(load_balancer)
+
+    # SSM
+
+    def send_command(self, instance_ids, commands):
+        message, filename = re.match(r"echo '(.*)' \| base64 -d > (\S+)\.tmp", commands[0]).groups()
+
+        invocations = []
+        for instance_id in instance_ids:
+            instance = self.nlb_instances.get(instance_id)
+            if instance is None or not instance.alive:
+                invocations.append({"InstanceId": instance_id, "Status": "Failed"})
+                continue
+
+            with open(os.path.join(instance.spool_folder, f"{os.path.basename(filename)}.json"), "wb") as fp:
+                fp.write(base64.b64decode(message))
+            invocations.append({"InstanceId": instance_id, "Status": "Success"})
+
+        command_id = str(uuid.uuid4())
+        self.commands[command_id] = invocations
+        return command_id
+
+    # AutoScaling
+
+    def complete_lifecycle_action(self, instance_id, result):
+        state = self.asg_instances.get(instance_id)
+        if state == "Pending:Wait" and result == "CONTINUE":
+            self.asg_instances[instance_id] = "InService"
+        elif state is not None:
+            del self.asg_instances[instance_id]
+            self.nlb_instances.pop(instance_id).destroy()
+
+    def expected_records(self):
+        ips = [self.ec2[instance_id] for instance_id, state in self.asg_instances.items() if state == "InService"]
+        return {
+            (HOSTED_ZONE_ID, DOMAIN_NAME, "A"): {ip["PublicIpAddress"] for ip in ips},
+            (HOSTED_ZONE_ID, DOMAIN_NAME, "AAAA"): {ip["Ipv6Address"] for ip in ips},
+            (PRIVATE_HOSTED_ZONE_ID, PRIVATE_DOMAIN_NAME, "A"): {ip["PrivateIpAddress"] for ip in ips},
+        }
+
+
+class Harness:
+    def __init__(self, central):
+        self.central = central
+        self.nginx, self.discovery, self.nlb_ecs, self.nlb_asg_lch = load_modules()
+        self.world = World()
+        self.invocations = Counter()
+        self.reloads = Counter()  # instance-id -> nginx reloads
+        self.time = SimulatedTime()
+        self.events_since = None  # when the oldest event in SQS arrived
+        self.next_schedule = TOPOLOGY_RESYNC_INTERVAL
+
+        client = FakeClient(self.world)
+        clients = {
+            "client_autoscaling": client,
+            "client_ec2": FakeEC2Client(self.world),
+            "client_ecs": FakeECSClient(self.world),
+            "client_route53": client,
+            "client_s3": client,
+            "client_ssm": client,
+        }
+        for module in (self.nginx, self.discovery, self.nlb_ecs, self.nlb_asg_lch):
+            for name, fake in clients.items():
+                if hasattr(module, name):
+                    setattr(module, name, fake)
+        self.nlb_asg_lch.http = FakeHttp(self.world)
+
+        self.nginx.time = self.time
+        # There is no nginx to validate the configuration with.
+        self.nginx.validate_nginx_config = lambda filename, events_filename: True
+
+        # Nothing is slow here; don't wait as if it is.
+        self.nlb_ecs.POLL_DELAY_MIN = 0.001
+        self.nlb_asg_lch.READY_DELAY_MIN = 0.001
+        self.nlb_asg_lch.DRAIN_POLL_DELAY = 0.001
+
+        os.environ.update(
+            {
+                "CLUSTER": CLUSTER,
+                "AUTO_SCALING_GROUP_NAME": AUTO_SCALING_GROUP_NAME,
+                "DOMAIN_NAME": DOMAIN_NAME,
+                "HOSTED_ZONE_ID": HOSTED_ZONE_ID,
+                "PRIVATE_DOMAIN_NAME": PRIVATE_DOMAIN_NAME,
+                "PRIVATE_HOSTED_ZONE_ID": PRIVATE_HOSTED_ZONE_ID,
+                # The TTL is not simulated; see the module docstring.
+                "DNS_TTL": "0",
+                "DRAIN_CONNECTIONS": "0",
+            }
+        )
+        if central:
+            os.environ.update({"TOPOLOGY_BUCKET": TOPOLOGY_BUCKET, "TOPOLOGY_KEY": TOPOLOGY_KEY})
+        else:
+            os.environ.pop("TOPOLOGY_BUCKET", None)
+            os.environ.pop("TOPOLOGY_KEY", None)
+
+    def close(self):
+        for instance in self.world.nlb_instances.values():
+            instance.destroy()
+
+    def invoke_ecs_lambda(self):
+        while self.world.events:
+            batch, self.world.events = self.world.events[:SQS_BATCH_SIZE], self.world.events[SQS_BATCH_SIZE:]
+            self.invocations["nlb-ecs"] += 1
+            self.nlb_ecs.lambda_handler({"Records": [{"body": json.dumps(event)} for event in batch]}, FakeContext(30))
+        self.events_since = None
+
+    def invoke_scheduled_ecs_lambda(self):
+        self.invocations["nlb-ecs (scheduled)"] += 1
+        self.nlb_ecs.lambda_handler({"source": "aws.events", "detail-type": "Scheduled Event"}, FakeContext(30))
+
+    def invoke_lifecycle_lambda(self, instance_id, transition):
+        self.invocations["nlb-asg-lch"] += 1
+        message = {
+            "EC2InstanceId": instance_id,
+            "LifecycleTransition": transition,
+            "AutoScalingGroupName": AUTO_SCALING_GROUP_NAME,
+            "LifecycleHookName": "harness",
+            "LifecycleActionToken": instance_id,
+        }
+        self.nlb_asg_lch.lambda_handler({"Records": [{"Sns": {"Message": json.dumps(message)}}]}, FakeContext(200))
+
+    def launch_nlb_instance(self):
+        instance_id = self.world.add_ec2()
+        self.world.asg_instances[instance_id] = "Pending:Wait"
+
+        instance = NlbInstance(self, instance_id, self.world.ec2[instance_id]["PrivateIpAddress"])
+        self.world.nlb_instances[instance_id] = instance
+        instance.boot()
+
+        self.invoke_lifecycle_lambda(instance_id, "autoscaling:EC2_INSTANCE_LAUNCHING")
+        return instance_id
+
+    def terminate_nlb_instance(self, instance_id):
+        self.world.asg_instances[instance_id] = "Terminating:Wait"
+        self.invoke_lifecycle_lambda(instance_id, "autoscaling:EC2_INSTANCE_TERMINATING")
+
+    def is_converged(self):
+        expected = self.world.expected_load_balancer()
+        for instance_id, state in self.world.asg_instances.items():
+            if state == "InService" and self.world.nlb_instances[instance_id].served() != expected:
+                return False
+
+        return all(self.world.records.get(key, set()) == value for key, value in self.world.expected_records().items())
+
+    def tick(self):
+        """Let a poll interval pass; returns the (simulated) time."""
+        self.time.sleep(POLL_INTERVAL)
+        now = self.time.monotonic()
+
+        if self.world.events:
+            if self.events_since is None:
+                self.events_since = now
+            if now - self.events_since >= SQS_BATCH_WINDOW or len(self.world.events) >= SQS_BATCH_SIZE:
+                self.invoke_ecs_lambda()
+
+        # Only with a central topology the schedule exists.
+        if now >= self.next_schedule:
+            if self.central:
+                self.invoke_scheduled_ecs_lambda()
+            self.next_schedule += TOPOLOGY_RESYNC_INTERVAL
+
+        for instance in list(self.world.nlb_instances.values()):
+            if instance.alive:
+                instance.step()
+
+        return now
+
+    def settle(self):
+        """Keep time till everything converged; returns how many (simulated) seconds that took."""
+        start = self.time.monotonic()
+        while self.time.monotonic() - start < MAX_SECONDS:
+            now = self.tick()
+            if self.is_converged():
+                return now - start
+        raise Exception(f"Did not converge within {MAX_SECONDS} seconds")
+
+
+def setup_cluster(harness, services, tasks_per_service, nlb_instances):
+    world = harness.world
+    for _ in range(max(1, services // 5)):
+        world.add_container_instance()
+
+    for i in range(services):
+        world.add_service(f"service-{i}", "tcp", 10000 + i)
+        for _ in range(tasks_per_service):
+            world.start_task(f"service-{i}")
+    # The cluster already existed before the NLB did.
+    world.events = []
+    if harness.central:
+        harness.nlb_ecs.publish_topology(CLUSTER, TOPOLOGY_BUCKET, TOPOLOGY_KEY)
+
+    for _ in range(nlb_instances):
+        harness.launch_nlb_instance()
+    harness.settle()
+
+
+def scenario_deploy_storm(harness):
+    """Every service is redeployed at once: all tasks are replaced."""
+    setup_cluster(harness, services=20, tasks_per_service=3, nlb_instances=2)
+
+    def act():
+        for task_arn in list(harness.world.tasks):
+            service_name = harness.world.tasks[task_arn]["group"][len("service:") :]
+            harness.world.start_task(service_name)
+            harness.world.stop_task(task_arn)
+
+    return act
+
+
+def scenario_scale_out(harness):
+    """The NLB scales from 2 to 6 instances, while a service is redeployed."""
+    setup_cluster(harness, services=20, tasks_per_service=2, nlb_instances=2)
+
+    def act():
+        for _ in range(4):
+            harness.launch_nlb_instance()
+            harness.world.start_task("service-0")
+
+    return act
+
+
+def scenario_dropped_events(harness):
+    """The events of a redeploy are lost; only the periodic resync can find out."""
+    setup_cluster(harness, services=20, tasks_per_service=2, nlb_instances=2)
+
+    def act():
+        for task_arn in list(harness.world.tasks)[:10]:
+            service_name = harness.world.tasks[task_arn]["group"][len("service:") :]
+            harness.world.start_task(service_name)
+            harness.world.stop_task(task_arn)
+        harness.world.events = []
+
+    return act
+
+
+def scenario_instance_loss(harness):
+    """An NLB instance dies; it is replaced, while tasks keep changing."""
+    setup_cluster(harness, services=20, tasks_per_service=2, nlb_instances=3)
+
+    def act():
+        instance_id = next(iter(harness.world.nlb_instances))
+        harness.world.nlb_instances[instance_id].alive = False
+        harness.world.stop_task(next(iter(harness.world.tasks)))
+        harness.invoke_ecs_lambda()
+
+        harness.terminate_nlb_instance(instance_id)
+        harness.launch_nlb_instance()
+
+    return act
+
+
+SCENARIOS = {
+    "deploy-storm": scenario_deploy_storm,
+    "dropped-events": scenario_dropped_events,
+    "scale-out": scenario_scale_out,
+    "instance-loss": scenario_instance_loss,
+}
+
+
+def run_scenario(name, central, verbose):
+    harness = Harness(central)
+    # What the Lambdas and instances print is only interesting when debugging.
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        with output:
+            act = SCENARIOS[name](harness)
+
+            # Only what the scenario itself causes is reported.
+            harness.world.calls.clear()
+            harness.invocations.clear()
+            harness.reloads.clear()
+
+            start = time.perf_counter()
+            act()
+            seconds = harness.settle()
+            wall_seconds = time.perf_counter() - start
+    finally:
+        harness.close()
+
+    print(
+        f"{name} ({'central' if central else 'delta'}): converged in {seconds:.1f} s "
+        f"(simulated; {wall_seconds:.1f} s to run)"
+    )
+    print(f"  Lambda invocations: {dict(sorted(harness.invocations.items()))}")
+    print(f"  nginx reloads: {sum(harness.reloads.values())} over {len(harness.reloads)} instance(s)")
+    print(f"  API calls: {sum(harness.world.calls.values())}")
+    for operation_name, count in sorted(harness.world.calls.items()):
+        print(f"    {operation_name}: {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run NLB control-plane scenarios against a fake AWS.")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), action="append", help="scenario to run (default: all)")
+    parser.add_argument(
+        "--mode",
+        choices=["central", "delta", "both"],
+        default="both",
+        help="whether the nlb-ecs Lambda publishes a central topology, or sends task changes",
+    )
+    parser.add_argument("--verbose", action="store_true", help="show the output of the Lambdas and instances")
+    args = parser.parse_args()
+
+    modes = {"central": [True], "delta": [False], "both": [True, False]}[args.mode]
+    for name in args.scenario or sorted(SCENARIOS):
+        for central in modes:
+            run_scenario(name, central, args.verbose)
+
+
+if __name__ == "__main__":
+    main()
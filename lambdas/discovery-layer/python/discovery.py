@@ -0,0 +1,300 @@
+"""
+Discovery of the endpoints of ECS services.
+
+This is shared between the Lambdas (as a layer) and the NLB instances
+(next to nginx.py). It resolves which tasks run where: for the NLB, per
+listener over the whole cluster; for the reload Lambdas, per service.
+
+The container instances and EC2 instances a task runs on are cached for
+as long as the process lives; a warm Lambda only has to look up the tasks.
+"""
+
+import boto3
+import time
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# Set by setup(); the NLB instances and the Lambdas get their region differently.
+client_ecs = None
+client_ec2 = None
+
+# The private IP of an EC2 instance, and the EC2 instance of a container
+# instance, never change during their lifetime, so these can be cached; the
+# TTL is only there to not keep old instances around.
+EC2_IP_CACHE_TTL = 3600
+
+ec2_ip_cache = {}  # instance-id -> (private-ip, expire-time)
+container_instance_cache = {}  # container-instance-arn -> (instance-id, expire-time)
+
+# Discovery requests run in parallel, but bounded, as the ECS API throttles
+# per account.
+DISCOVERY_WORKERS = 8
+
+
+def setup(region=None):
+    global client_ecs, client_ec2
+
+    client_ecs = boto3.client("ecs", region_name=region)
+    client_ec2 = boto3.client("ec2", region_name=region)
+
+
+def get_listener(tags):
+    tags = {tag["key"]: tag["value"] for tag in tags}
+
+    protocol = tags.get("NLB-protocol")
+    port = tags.get("NLB-port")
+
+    if not protocol or not port:
+        return None
+
+    return protocol, int(port)
+
+
+def get_listener_options(tags):
+    """Get how the listener balances over its backends; options not set by tags are left to the defaults."""
+    tags = {tag["key"]: tag["value"] for tag in tags}
+
+    options = {}
+    if "NLB-balance" in tags:
+        options["balance"] = tags["NLB-balance"]
+    if "NLB-max-fails" in tags:
+        options["max_fails"] = int(tags["NLB-max-fails"])
+    if "NLB-fail-timeout" in tags:
+        options["fail_timeout"] = int(tags["NLB-fail-timeout"])
+    if "NLB-reuseport" in tags:
+        options["reuseport"] = tags["NLB-reuseport"] == "true"
+    if "NLB-backlog" in tags:
+        options["backlog"] = int(tags["NLB-backlog"])
+    if "NLB-buffer-size" in tags:
+        options["buffer_size"] = int(tags["NLB-buffer-size"])
+    if "NLB-proxy-protocol" in tags:
+        options["proxy_protocol"] = tags["NLB-proxy-protocol"]
+    if "NLB-udp-stateless" in tags:
+        options["udp_stateless"] = tags["NLB-udp-stateless"] == "true"
+
+    return options
+
+
+def get_task_backends(task, port, container_mapping):
+    backends = set()
+
+    if task["lastStatus"] != "RUNNING" or task["desiredStatus"] != "RUNNING":
+        return backends
+
+    # Without a known host, there is nothing to forward to.
+    host_ip = container_mapping.get(task["containerInstanceArn"])
+    if host_ip is None:
+        return backends
+
+    for container in task["containers"]:
+        for network_binding in container.get("networkBindings", []):
+            if network_binding["containerPort"] == port:
+                backends.add((host_ip, network_binding["hostPort"]))
+
+    return backends
+
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def expire_cache(cache, now):
+    for key, (_, expire) in list(cache.items()):
+        if expire < now:
+            del cache[key]
+
+
+def fetch_ec2_ips(instance_ids):
+    now = time.monotonic()
+    expire_cache(ec2_ip_cache, now)
+
+    # Mind: describe_instances() without InstanceIds returns all instances.
+    missing = [instance_id for instance_id in instance_ids if instance_id not in ec2_ip_cache]
+    if missing:
+        paginator = client_ec2.get_paginator("describe_instances")
+        for page in paginator.paginate(InstanceIds=missing):
+            for reservation in page["Reservations"]:
+                for instance in reservation["Instances"]:
+                    if "PrivateIpAddress" in instance:
+                        ec2_ip_cache[instance["InstanceId"]] = (instance["PrivateIpAddress"], now + EC2_IP_CACHE_TTL)
+
+    return {instance_id: ec2_ip_cache[instance_id][0] for instance_id in instance_ids if instance_id in ec2_ip_cache}
+
+
+def fetch_container_mapping(cluster):
+    container_instance_arns = []
+    paginator = client_ecs.get_paginator("list_container_instances")
+    for page in paginator.paginate(cluster=cluster, status="ACTIVE"):
+        container_instance_arns.extend(page["containerInstanceArns"])
+
+    containers = []
+    for container_instance_arns_chunk in chunks(container_instance_arns, 100):
+        response = client_ecs.describe_container_instances(
+            cluster=cluster, containerInstances=container_instance_arns_chunk
+        )
+        containers.extend(container for container in response["containerInstances"] if container["status"] == "ACTIVE")
+
+    ec2_ips = fetch_ec2_ips([container["ec2InstanceId"] for container in containers])
+
+    container_mapping = {}
+    now = time.monotonic()
+    for container in containers:
+        container_instance_cache[container["containerInstanceArn"]] = (
+            container["ec2InstanceId"],
+            now + EC2_IP_CACHE_TTL,
+        )
+        container_mapping[container["containerInstanceArn"]] = ec2_ips.get(container["ec2InstanceId"])
+
+    return container_mapping
+
+
+def fetch_container_ips(cluster, container_instance_arns):
+    """Resolve container instances to their private IP; only those not seen before cost API calls."""
+    now = time.monotonic()
+    expire_cache(container_instance_cache, now)
+
+    missing = [arn for arn in container_instance_arns if arn not in container_instance_cache]
+    for container_instance_arns_chunk in chunks(missing, 100):
+        response = client_ecs.describe_container_instances(
+            cluster=cluster, containerInstances=container_instance_arns_chunk
+        )
+        for container in response["containerInstances"]:
+            container_instance_cache[container["containerInstanceArn"]] = (
+                container["ec2InstanceId"],
+                now + EC2_IP_CACHE_TTL,
+            )
+
+    instance_ids = {
+        arn: container_instance_cache[arn][0] for arn in container_instance_arns if arn in container_instance_cache
+    }
+    ec2_ips = fetch_ec2_ips(list(set(instance_ids.values())))
+
+    return {arn: ec2_ips.get(instance_id) for arn, instance_id in instance_ids.items()}
+
+
+def describe_services(cluster, service_names):
+    """
+    Describe services (with their tags), as service-name -> (listener, options).
+
+    The value is None if the service is not behind the NLB.
+    """
+    services = {}
+
+    for service_names_chunk in chunks(service_names, 10):
+        response = client_ecs.describe_services(cluster=cluster, services=service_names_chunk, include=["TAGS"])
+        for service in response["services"]:
+            tags = service.get("tags", [])
+            listener = get_listener(tags)
+            services[service["serviceName"]] = None if listener is None else (listener, get_listener_options(tags))
+
+    return services
+
+
+def fetch_services(cluster):
+    service_names = []
+    paginator = client_ecs.get_paginator("list_services")
+    for page in paginator.paginate(cluster=cluster):
+        service_names.extend(service.split("/")[-1] for service in page["serviceArns"])
+
+    services = {}
+    with ThreadPoolExecutor(max_workers=DISCOVERY_WORKERS) as executor:
+        for result in executor.map(lambda chunk: describe_services(cluster, chunk), chunks(service_names, 10)):
+            services.update(result)
+
+    return services
+
+
+def list_service_tasks(cluster, service_name):
+    task_arns = []
+    paginator = client_ecs.get_paginator("list_tasks")
+    for page in paginator.paginate(cluster=cluster, serviceName=service_name):
+        task_arns.extend(page["taskArns"])
+
+    return task_arns
+
+
+def fetch_tasks(cluster, services):
+    """Fetch the tasks of all services behind the NLB, as a list of (listener, task)."""
+    service_names = [service_name for service_name, service in services.items() if service is not None]
+
+    with ThreadPoolExecutor(max_workers=DISCOVERY_WORKERS) as executor:
+        task_listener = {}
+        for service_name, task_arns in zip(
+            service_names, executor.map(lambda service_name: list_service_tasks(cluster, service_name), service_names)
+        ):
+            for task_arn in task_arns:
+                task_listener[task_arn] = services[service_name][0]
+
+        # Tasks of all services are described together, in batches of the
+        # maximum describe_tasks() allows.
+        tasks = []
+        for response in executor.map(
+            lambda task_arns: client_ecs.describe_tasks(cluster=cluster, tasks=task_arns),
+            chunks(list(task_listener), 100),
+        ):
+            tasks.extend((task_listener[task["taskArn"]], task) for task in response["tasks"])
+
+    return tasks
+
+
+def describe_tasks(cluster, task_arns):
+    tasks = []
+    for task_arns_chunk in chunks(task_arns, 100):
+        tasks.extend(client_ecs.describe_tasks(cluster=cluster, tasks=task_arns_chunk)["tasks"])
+
+    return tasks
+
+
+def fetch_service_tasks(cluster, service_name, container_port):
+    """Fetch the running tasks of a service, as task-arn -> sorted list of (host-ip, host-port)."""
+    tasks = describe_tasks(cluster, list_service_tasks(cluster, service_name))
+    container_ips = fetch_container_ips(
+        cluster, list({task["containerInstanceArn"] for task in tasks if task.get("containerInstanceArn")})
+    )
+
+    service_tasks = {}
+    for task in tasks:
+        endpoints = get_task_backends(task, container_port, container_ips)
+        if endpoints:
+            service_tasks[task["taskArn"]] = sorted(endpoints)
+
+    return service_tasks
+
+
+def fetch_service_endpoints(cluster, service_name, container_port):
+    """Fetch the endpoints of the running tasks of a service, as a sorted list of (host-ip, host-port)."""
+    service_tasks = fetch_service_tasks(cluster, service_name, container_port)
+    return sorted(endpoint for endpoints in service_tasks.values() for endpoint in endpoints)
+
+
+def get_services_listener_options(services):
+    return {service[0]: service[1] for service in services.values() if service is not None}
+
+
+def fetch_active_tasks(cluster, container_mapping):
+    """Fetch the backends of all listeners; returns the load-balancer and the options of the listeners."""
+    services = fetch_services(cluster)
+    load_balancer = defaultdict(set)
+
+    for listener, task in fetch_tasks(cluster, services):
+        load_balancer[listener].update(get_task_backends(task, listener[1], container_mapping))
+
+    return load_balancer, get_services_listener_options(services)
+
+
+def load_balancer_to_artifact(load_balancer, listener_options, version):
+    return {
+        "version": version,
+        "listeners": [
+            {
+                "protocol": protocol,
+                "port": port,
+                "backends": sorted([host_ip, host_port] for host_ip, host_port in load_balancer[(protocol, port)]),
+                "options": listener_options.get((protocol, port), {}),
+            }
+            for protocol, port in sorted(load_balancer)
+            if load_balancer[(protocol, port)]
+        ],
+    }
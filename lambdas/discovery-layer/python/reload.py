@@ -0,0 +1,154 @@
+"""
+Reload the running tasks of a service; shared by the reload Lambdas.
+
+Two modes:
+- parallel: every task is reloaded at the same time.
+- rolling: a batch of tasks at the time; the next batch only starts once
+  the previous one is healthy again, so the others keep serving.
+
+When the reload carries a version (of the content to reload), tasks that
+already reloaded that version are skipped. These versions are remembered
+for as long as the Lambda is warm; after a cold start every task is
+reloaded once more.
+
+Instead of printing, a report is returned with per task the status and
+how long the reload took.
+"""
+
+import json
+import time
+import urllib3
+
+from concurrent.futures import ThreadPoolExecutor
+
+MODES = ("parallel", "rolling")
+
+# Reloads run in parallel, but bounded; this is also the size of the pool.
+RELOAD_WORKERS = 16
+RELOAD_TIMEOUT = urllib3.Timeout(connect=5, read=60)
+# Health is checked quickly at first, backing off to this maximum.
+HEALTH_DELAY_MIN = 0.25
+HEALTH_DELAY_MAX = 4
+HEALTH_TIMEOUT = urllib3.Timeout(connect=1, read=1)
+
+# Shared by all reloads (and warm invocations), so contacting the tasks
+# doesn't set up a new pool every time.
+http = urllib3.PoolManager(maxsize=RELOAD_WORKERS)
+
+applied_versions = {}  # task-arn -> version of the last successful reload
+
+
+def get_task_id(task_arn):
+    return task_arn.split("/")[-1]
+
+
+def reload_task(task_arn, endpoint, payload):
+    host_ip, host_port = endpoint
+    result = {"task": get_task_id(task_arn), "endpoint": f"{host_ip}:{host_port}", "status": None, "seconds": None}
+
+    start = time.monotonic()
+    try:
+        response = http.request(
+            "POST",
+            f"http://{host_ip}:{host_port}/reload",
+            body=json.dumps(payload),
+            headers={"Content-Type": "application/json"},
+            timeout=RELOAD_TIMEOUT,
+            retries=False,
+        )
+        result["status"] = "reloaded" if response.status == 204 else f"failed ({response.status})"
+    except (urllib3.exceptions.NewConnectionError, urllib3.exceptions.ConnectTimeoutError):
+        result["status"] = "unreachable"
+    except urllib3.exceptions.ReadTimeoutError:
+        result["status"] = "timeout"
+    except urllib3.exceptions.HTTPError as e:
+        # Like the connection being reset, as the task restarts while reloading.
+        result["status"] = f"failed ({e.__class__.__name__})"
+
+    result["seconds"] = round(time.monotonic() - start, 3)
+    return result
+
+
+def is_healthy(endpoint):
+    host_ip, host_port = endpoint
+    try:
+        response = http.request("GET", f"http://{host_ip}:{host_port}/healthz", timeout=HEALTH_TIMEOUT, retries=False)
+    except urllib3.exceptions.HTTPError:
+        return False
+
+    return response.status == 200
+
+
+def wait_until_healthy(endpoints, deadline):
+    delay = HEALTH_DELAY_MIN
+    while not all(is_healthy(endpoint) for endpoint in endpoints):
+        if time.monotonic() + delay > deadline:
+            return False
+
+        time.sleep(delay)
+        delay = min(delay * 2, HEALTH_DELAY_MAX)
+
+    return True
+
+
+def reload_tasks(tasks, payload, deadline, mode="parallel", batch_size=1, version=None, force=False):
+    """
+    Reload tasks (as task-arn -> endpoints); returns a report with the result per task.
+
+    With a version, tasks that already reloaded it are skipped, unless forced.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown reload mode: {mode}")
+
+    # Forget about tasks that are gone.
+    for task_arn in list(applied_versions):
+        if task_arn not in tasks:
+            del applied_versions[task_arn]
+
+    results = []
+    pending = []
+    for task_arn, endpoints in sorted(tasks.items()):
+        if not force and version is not None and applied_versions.get(task_arn) == version:
+            results.append({"task": get_task_id(task_arn), "status": "current", "seconds": None})
+        else:
+            # A task is reloaded once, even if it has more endpoints.
+            pending.append((task_arn, endpoints[0]))
+
+    if mode == "parallel":
+        batches = [pending]
+    else:
+        batches = [pending[i : i + batch_size] for i in range(0, len(pending), batch_size)]
+
+    start = time.monotonic()
+    healthy = True
+    with ThreadPoolExecutor(max_workers=RELOAD_WORKERS) as executor:
+        for i, batch in enumerate(batches):
+            # Never take down more tasks when the previous batch didn't come back.
+            if not healthy or time.monotonic() > deadline:
+                results.extend(
+                    {"task": get_task_id(task_arn), "status": "skipped", "seconds": None} for task_arn, _ in batch
+                )
+                continue
+
+            batch_results = list(executor.map(lambda task: reload_task(task[0], task[1], payload), batch))
+            results.extend(batch_results)
+
+            if i + 1 < len(batches) and not wait_until_healthy([endpoint for _, endpoint in batch], deadline):
+                healthy = False
+                for result in batch_results:
+                    if result["status"] == "reloaded":
+                        result["status"] = "unhealthy"
+
+            for (task_arn, _), result in zip(batch, batch_results):
+                if version is not None and result["status"] == "reloaded":
+                    applied_versions[task_arn] = version
+
+    return {
+        "mode": mode,
+        "version": version,
+        "seconds": round(time.monotonic() - start, 3),
+        "reloaded": sum(1 for result in results if result["status"] == "reloaded"),
+        "current": sum(1 for result in results if result["status"] == "current"),
+        "failed": sum(1 for result in results if result["status"] not in ("reloaded", "current")),
+        "tasks": results,
+    }
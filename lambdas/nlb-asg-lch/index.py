@@ -4,16 +4,36 @@ import os
 import time
 import urllib3
 
+from botocore.exceptions import WaiterError
+from concurrent.futures import ThreadPoolExecutor
+
 client_autoscaling = boto3.client("autoscaling")
 client_ec2 = boto3.client("ec2")
 client_route53 = boto3.client("route53")
 
+# Shared by all probes (and warm invocations), so probing doesn't set up a
+# new pool every time.
+http = urllib3.PoolManager()
+
+# Readiness is probed quickly at first, backing off to this maximum.
+READY_DELAY_MIN = 0.25
+READY_DELAY_MAX = 8
+# Seconds kept free at the end of the Lambda timeout; the Lambda timeout is
+# 20 seconds longer than the Lifecycle Hook timeout.
+DEADLINE_MARGIN = 25
+# Seconds between checks if a Route53 change is INSYNC.
+ROUTE53_POLL_DELAY = 2
+# Seconds between checks of the active connections of a draining instance.
+DRAIN_POLL_DELAY = 5
+
 
 def lambda_handler(event, context):
     domain_name = os.environ["DOMAIN_NAME"]
     hosted_zone_id = os.environ["HOSTED_ZONE_ID"]
     private_domain_name = os.environ["PRIVATE_DOMAIN_NAME"]
     private_hosted_zone_id = os.environ["PRIVATE_HOSTED_ZONE_ID"]
+    dns_ttl = int(os.environ["DNS_TTL"])
+    drain_connections = int(os.environ["DRAIN_CONNECTIONS"])
 
     lifecycle_event = json.loads(event["Records"][0]["Sns"]["Message"])
     instance_id = lifecycle_event.get("EC2InstanceId")
@@ -25,35 +45,61 @@ def lambda_handler(event, context):
     print(f"Hosted-zone-id: {hosted_zone_id}")
     print(f"Private-domain-name: {private_domain_name}")
     print(f"Private-hosted-zone-id: {private_hosted_zone_id}")
+    print(f"DNS-TTL: {dns_ttl}")
+    print(f"Drain-connections: {drain_connections}")
     print(f"Instance-id: {instance_id}")
     print(f"Lifecycle-transition: {lifecycle_event['LifecycleTransition']}")
 
     if lifecycle_event["LifecycleTransition"] == "autoscaling:EC2_INSTANCE_TERMINATING":
+        deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - DEADLINE_MARGIN
+
         print("Instance is being terminated; updating Route53 ..")
-        update_route53(
+        change_ids = update_route53(
             lifecycle_event["AutoScalingGroupName"],
             domain_name,
             hosted_zone_id,
             private_domain_name,
             private_hosted_zone_id,
+            dns_ttl,
             ignore_instance_id=instance_id,
         )
 
+        if change_ids:
+            if wait_for_route53(change_ids, deadline):
+                print("Route53 is in sync")
+            else:
+                print("Route53 did not get in sync in time")
+
+            # Resolvers can still hand out the old records for up to the TTL;
+            # keep the instance alive till they have expired.
+            print(f"Waiting {dns_ttl} seconds for resolvers to forget about the instance ..")
+            time.sleep(max(0, min(dns_ttl, deadline - time.monotonic())))
+
+        internal_ip = get_private_ip(instance_id)
+        if internal_ip:
+            print(f"Draining connections on internal-ip {internal_ip} ..")
+            if wait_until_drained(internal_ip, drain_connections, deadline):
+                print("Instance is drained")
+            else:
+                print("Instance did not drain in time; terminating anyway")
+
         finish(lifecycle_event)
         return
 
     if lifecycle_event["LifecycleTransition"] == "autoscaling:EC2_INSTANCE_LAUNCHING":
-        instances = client_ec2.describe_instances(InstanceIds=[instance_id])
-        internal_ip = instances["Reservations"][0]["Instances"][0].get("PrivateIpAddress")
+        internal_ip = get_private_ip(instance_id)
         if not internal_ip:
             # This is most likely a retry when we crashed or something; not
             # really a state we can recover from, so just forget about it.
             print("No private ip found; most likely a retry. Aborting.")
             return
 
-        print(f"Waiting for webserver on internal-ip {internal_ip} to respond ..")
-        while not passes_health_check(internal_ip):
-            time.sleep(10)
+        print(f"Waiting for nginx on internal-ip {internal_ip} to be ready ..")
+        deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - DEADLINE_MARGIN
+        if not wait_until_ready(internal_ip, deadline):
+            print("Instance did not become ready in time; abandoning it.")
+            finish(lifecycle_event, result="ABANDON")
+            return
 
         finish(lifecycle_event)
 
@@ -64,6 +110,7 @@ def lambda_handler(event, context):
             hosted_zone_id,
             private_domain_name,
             private_hosted_zone_id,
+            dns_ttl,
             additional_instance_id=instance_id,
         )
         return
@@ -72,26 +119,82 @@ def lambda_handler(event, context):
     finish(lifecycle_event)
 
 
-def finish(lifecycle_event):
+def finish(lifecycle_event, result="CONTINUE"):
     client_autoscaling.complete_lifecycle_action(
-        LifecycleActionResult="CONTINUE",
+        LifecycleActionResult=result,
         **pick(lifecycle_event, "LifecycleHookName", "LifecycleActionToken", "AutoScalingGroupName"),
     )
 
 
-def passes_health_check(ip):
-    http = urllib3.PoolManager()
+def is_ready(ip):
+    """Check if nginx is up, and has rendered at least one stream upstream to forward traffic to."""
     try:
-        response = http.request(
-            "GET", f"http://{ip}/healthz", timeout=urllib3.Timeout(connect=1, read=1), retries=False
-        )
-        return response.status == 200
-    except urllib3.exceptions.NewConnectionError:
+        response = http.request("GET", f"http://{ip}/readyz", timeout=urllib3.Timeout(connect=1, read=1), retries=False)
+    except urllib3.exceptions.HTTPError:
+        return False
+
+    if response.status != 200:
         return False
-    except urllib3.exceptions.ConnectTimeoutError:
+
+    try:
+        return json.loads(response.data)["upstreams"] > 0
+    except (ValueError, KeyError, TypeError):
         return False
 
 
+def wait_until_ready(ip, deadline):
+    delay = READY_DELAY_MIN
+    while not is_ready(ip):
+        if time.monotonic() + delay > deadline:
+            return False
+
+        time.sleep(delay)
+        delay = min(delay * 2, READY_DELAY_MAX)
+
+    return True
+
+
+def get_private_ip(instance_id):
+    instances = client_ec2.describe_instances(InstanceIds=[instance_id])
+    return instances["Reservations"][0]["Instances"][0].get("PrivateIpAddress")
+
+
+def get_connections(ip):
+    """Get the amount of clients nginx is still proxying; None if this is unknown."""
+    try:
+        response = http.request(
+            "GET", f"http://{ip}/connections", timeout=urllib3.Timeout(connect=1, read=1), retries=False
+        )
+    except urllib3.exceptions.HTTPError:
+        return None
+
+    if response.status != 200:
+        return None
+
+    try:
+        return int(json.loads(response.data)["connections"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def wait_until_drained(ip, threshold, deadline):
+    while True:
+        connections = get_connections(ip)
+        if connections is None:
+            # Without a count there is nothing to wait for.
+            print("Could not get the active connections of the instance")
+            return True
+
+        print(f"Active connections: {connections}")
+        if connections <= threshold:
+            return True
+
+        if time.monotonic() + DRAIN_POLL_DELAY > deadline:
+            return False
+
+        time.sleep(DRAIN_POLL_DELAY)
+
+
 def pick(dct, *keys):
     """Pick a subset of a dict."""
     return {k: v for k, v in dct.items() if k in keys}
@@ -103,27 +206,29 @@ def update_route53(
     hosted_zone_id,
     private_domain_name,
     private_hosted_zone_id,
+    dns_ttl,
     ignore_instance_id=None,
     additional_instance_id=None,
 ):
+    """Update the public and private records of the NLB; returns the Route53 change-ids."""
     ipv4s, ipv6s, private_ipv4s = get_ips_from_asg(
         auto_scaling_group_name, ignore_instance_id=ignore_instance_id, additional_instance_id=additional_instance_id
     )
 
     if not ipv4s or not ipv6s or not private_ipv4s:
         print("There were no active instances for this AutoscalingGroup; not updating route53!")
-        return
+        return []
 
-    client_route53.change_resource_record_sets(
-        HostedZoneId=hosted_zone_id,
-        ChangeBatch={
-            "Changes": [
+    zone_changes = [
+        (
+            hosted_zone_id,
+            [
                 {
                     "Action": "UPSERT",
                     "ResourceRecordSet": {
                         "Name": domain_name,
                         "Type": "A",
-                        "TTL": 60,
+                        "TTL": dns_ttl,
                         "ResourceRecords": [{"Value": ipv4} for ipv4 in ipv4s],
                     },
                 },
@@ -132,30 +237,53 @@ def update_route53(
                     "ResourceRecordSet": {
                         "Name": domain_name,
                         "Type": "AAAA",
-                        "TTL": 60,
+                        "TTL": dns_ttl,
                         "ResourceRecords": [{"Value": ipv6} for ipv6 in ipv6s],
                     },
                 },
-            ]
-        },
-    )
-
-    client_route53.change_resource_record_sets(
-        HostedZoneId=private_hosted_zone_id,
-        ChangeBatch={
-            "Changes": [
+            ],
+        ),
+        (
+            private_hosted_zone_id,
+            [
                 {
                     "Action": "UPSERT",
                     "ResourceRecordSet": {
                         "Name": private_domain_name,
                         "Type": "A",
-                        "TTL": 60,
+                        "TTL": dns_ttl,
                         "ResourceRecords": [{"Value": ipv4} for ipv4 in private_ipv4s],
                     },
                 },
-            ]
-        },
-    )
+            ],
+        ),
+    ]
+
+    # Both zones are updated at the same time.
+    with ThreadPoolExecutor(max_workers=len(zone_changes)) as executor:
+        responses = executor.map(
+            lambda zone_change: client_route53.change_resource_record_sets(
+                HostedZoneId=zone_change[0], ChangeBatch={"Changes": zone_change[1]}
+            ),
+            zone_changes,
+        )
+        return [response["ChangeInfo"]["Id"] for response in responses]
+
+
+def wait_for_route53(change_ids, deadline):
+    """Wait till all Route53 changes are INSYNC; returns False if the deadline passed first."""
+    max_attempts = max(1, int((deadline - time.monotonic()) / ROUTE53_POLL_DELAY))
+
+    def wait(change_id):
+        waiter = client_route53.get_waiter("resource_record_sets_changed")
+        try:
+            waiter.wait(Id=change_id, WaiterConfig={"Delay": ROUTE53_POLL_DELAY, "MaxAttempts": max_attempts})
+        except WaiterError:
+            return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=len(change_ids)) as executor:
+        return all(list(executor.map(wait, change_ids)))
 
 
 def get_ips_from_asg(auto_scaling_group_name, ignore_instance_id=None, additional_instance_id=None):
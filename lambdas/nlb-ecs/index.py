@@ -1,4 +1,7 @@
+import base64
 import boto3
+import discovery
+import hashlib
 import json
 import os
 import time
@@ -6,13 +9,140 @@ import time
 from botocore.exceptions import ClientError
 
 client_autoscaling = boto3.client("autoscaling")
+client_s3 = boto3.client("s3")
 client_ssm = boto3.client("ssm")
+discovery.setup()
 
+SPOOL_FOLDER = "/var/spool/nlb"
+# RunCommand parameters are limited in size. If a window has more changes
+# than fit, the instances are asked to do a full resync instead.
+MAX_MESSAGE_SIZE = 24 * 1024
 
-def lambda_handler(event, context):
-    print(json.dumps(event))
+# Polling for the RunCommand to finish starts fast, and backs off to this
+# maximum while waiting for slower instances.
+POLL_DELAY_MIN = 0.25
+POLL_DELAY_MAX = 2
+# Seconds kept free at the end of the Lambda timeout to report the result.
+DEADLINE_MARGIN = 2
+COMMAND_FINAL_STATUSES = ("Success", "Cancelled", "TimedOut", "Failed")
 
-    auto_scaling_group_name = os.environ["AUTO_SCALING_GROUP_NAME"]
+# Whether a service is behind the NLB doesn't change during its lifetime;
+# remember it across invocations.
+nlb_service_cache = {}  # service-name -> bool
+
+# Hash of the last published topology, to not publish the same one twice.
+published_topology_hash = None
+
+
+def get_task_delta(detail):
+    """Only keep the fields of a task that the NLB needs to know about."""
+    return {
+        "taskArn": detail["taskArn"],
+        "group": detail.get("group", ""),
+        "version": detail.get("version", 0),
+        "lastStatus": detail.get("lastStatus"),
+        "desiredStatus": detail.get("desiredStatus"),
+        "containerInstanceArn": detail.get("containerInstanceArn"),
+        "containers": [
+            {"networkBindings": container.get("networkBindings", [])} for container in detail.get("containers", [])
+        ],
+    }
+
+
+def fetch_nlb_services(cluster, service_names):
+    unknown_service_names = [service_name for service_name in service_names if service_name not in nlb_service_cache]
+
+    for service_name, service in discovery.describe_services(cluster, unknown_service_names).items():
+        nlb_service_cache[service_name] = service is not None
+
+    return {service_name for service_name in service_names if nlb_service_cache.get(service_name)}
+
+
+def wait_for_command(command_id, instance_ids, deadline):
+    """Wait for all instances to finish a command; returns per instance the status and how long it took."""
+    start = time.monotonic()
+    results = {instance_id: {"status": "Pending", "seconds": None} for instance_id in instance_ids}
+
+    delay = POLL_DELAY_MIN
+    while True:
+        pending = [instance_id for instance_id, result in results.items() if result["seconds"] is None]
+        if not pending:
+            break
+
+        if time.monotonic() + delay > deadline:
+            for instance_id in pending:
+                print(
+                    f"{instance_id} did not finish before the deadline (last status: {results[instance_id]['status']})"
+                )
+            break
+
+        time.sleep(delay)
+
+        # One call for all instances, instead of one per instance.
+        finished = 0
+        paginator = client_ssm.get_paginator("list_command_invocations")
+        for page in paginator.paginate(CommandId=command_id):
+            for invocation in page["CommandInvocations"]:
+                result = results.get(invocation["InstanceId"])
+                if result is None or result["seconds"] is not None:
+                    continue
+
+                result["status"] = invocation["Status"]
+                if invocation["Status"] in COMMAND_FINAL_STATUSES:
+                    result["seconds"] = round(time.monotonic() - start, 3)
+                    finished += 1
+
+        # As long as instances are finishing, keep polling quickly; back off
+        # when we are waiting on stragglers.
+        if not finished:
+            delay = min(delay * 2, POLL_DELAY_MAX)
+
+    return results
+
+
+def publish_topology(cluster, bucket, key, check_bucket=False):
+    """
+    Publish the current topology for the NLB instances to fetch; returns the version, or None if unchanged.
+
+    With check_bucket, what is published is looked up in the bucket, instead
+    of trusting what this Lambda remembers of it.
+    """
+    global published_topology_hash
+
+    container_mapping = discovery.fetch_container_mapping(cluster)
+    load_balancer, listener_options = discovery.fetch_active_tasks(cluster, container_mapping)
+
+    listeners = discovery.load_balancer_to_artifact(load_balancer, listener_options, 0)["listeners"]
+    topology_hash = hashlib.sha256(json.dumps(listeners).encode()).hexdigest()
+
+    if published_topology_hash is None or check_bucket:
+        published_topology_hash = None
+        try:
+            response = client_s3.head_object(Bucket=bucket, Key=key)
+            published_topology_hash = response["Metadata"].get("sha256")
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "404":
+                raise
+
+    if topology_hash == published_topology_hash:
+        return None
+
+    version = int(time.time() * 1000)
+    client_s3.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps(discovery.load_balancer_to_artifact(load_balancer, listener_options, version)).encode(),
+        ContentType="application/json",
+        Metadata={"sha256": topology_hash},
+    )
+    published_topology_hash = topology_hash
+
+    return version
+
+
+def notify_instances(auto_scaling_group_name, message, context):
+    """Drop the message in the spool folder of every instance in service; returns per instance how that went."""
+    message = base64.b64encode(message.encode()).decode()
 
     asg = client_autoscaling.describe_auto_scaling_groups(AutoScalingGroupNames=[auto_scaling_group_name])
     instance_ids = [
@@ -21,7 +151,11 @@ def lambda_handler(event, context):
         if instance["LifecycleState"] == "InService"
     ]
 
-    print(f"Starting nlb-reload on {len(instance_ids)} instances ..")
+    # The spool folder is processed in filename order; the request-id makes
+    # sure two invocations in the same millisecond don't overwrite each other.
+    filename = f"{SPOOL_FOLDER}/{int(time.time() * 1000):013d}-{context.aws_request_id}"
+
+    print(f"Delivering task changes to {len(instance_ids)} instances ..")
 
     response = client_ssm.send_command(
         InstanceIds=instance_ids,
@@ -29,32 +163,75 @@ def lambda_handler(event, context):
         DocumentVersion="1",
         Parameters={
             "commands": [
-                "cd /etc/nginx/nlb.d",
-                "/venv/bin/python /nlb/nginx.py",
-                "systemctl reload nginx",
+                f"echo '{message}' | base64 -d > {filename}.tmp",
+                f"mv {filename}.tmp {filename}.json",
             ]
         },
     )
     command_id = response["Command"]["CommandId"]
 
-    for instance_id in instance_ids:
-        print(f"Waiting for {instance_id} to finish ..")
+    # Leave some time to report back before the Lambda itself times out.
+    deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - DEADLINE_MARGIN
 
-        while True:
-            time.sleep(1)
+    result = {
+        "command_id": command_id,
+        "instances": wait_for_command(command_id, instance_ids, deadline),
+    }
+    print(json.dumps(result))
+    return result
 
-            try:
-                response = client_ssm.get_command_invocation(
-                    CommandId=command_id,
-                    InstanceId=instance_id,
-                )
-            except ClientError as e:
-                if e.response["Error"]["Code"] == "InvocationDoesNotExist":
-                    continue
-                raise
 
-            if response["Status"] == "InProgress":
-                continue
+def lambda_handler(event, context):
+    cluster = os.environ["CLUSTER"]
+    auto_scaling_group_name = os.environ["AUTO_SCALING_GROUP_NAME"]
+    topology_bucket = os.environ.get("TOPOLOGY_BUCKET")
+    topology_key = os.environ.get("TOPOLOGY_KEY")
 
-            print(f"{instance_id} finished with status {response['Status']}")
-            break
+    # Not from SQS, but the schedule. Events can be dropped, or their
+    # invocation can fail; a full publish on a schedule heals any change
+    # that was missed that way. Without a central topology the instances
+    # do their own full scans, and there is nothing to do here.
+    if "Records" not in event:
+        if not topology_bucket:
+            return
+
+        version = publish_topology(cluster, topology_bucket, topology_key, check_bucket=True)
+        if version is None:
+            print("Topology is unchanged; not notifying instances")
+            return
+
+        print(f"Published topology version {version}, which was missed by earlier changes")
+        return notify_instances(auto_scaling_group_name, json.dumps({"topology": version}), context)
+
+    # The events of a whole window arrive in one batch; per task, only the
+    # most recent change is relevant.
+    deltas = {}
+    for record in event["Records"]:
+        delta = get_task_delta(json.loads(record["body"])["detail"])
+
+        previous = deltas.get(delta["taskArn"])
+        if previous is None or previous["version"] < delta["version"]:
+            deltas[delta["taskArn"]] = delta
+
+    nlb_services = fetch_nlb_services(cluster, {delta["group"][len("service:") :] for delta in deltas.values()})
+    deltas = [delta for delta in deltas.values() if delta["group"][len("service:") :] in nlb_services]
+
+    print(f"Received {len(event['Records'])} task changes; {len(deltas)} tasks of services behind the NLB changed")
+    if not deltas:
+        return
+
+    if topology_bucket:
+        # Discover once for all instances; they only fetch the result.
+        version = publish_topology(cluster, topology_bucket, topology_key)
+        if version is None:
+            print("Topology is unchanged; not notifying instances")
+            return
+
+        print(f"Published topology version {version}")
+        message = json.dumps({"topology": version})
+    else:
+        message = json.dumps({"events": deltas})
+        if len(message) > MAX_MESSAGE_SIZE:
+            message = json.dumps({"resync": True})
+
+    return notify_instances(auto_scaling_group_name, message, context)
@@ -0,0 +1,30 @@
+from aws_cdk.core import Construct
+from aws_cdk.aws_lambda import (
+    Code,
+    LayerVersion,
+    Runtime,
+)
+
+
+class DiscoveryLayer(Construct):
+    """
+    Lambda layer with the shared modules in lambdas/discovery-layer: the
+    discovery of ECS services, and the reloading of their tasks.
+
+    The discovery module is installed on the NLB instances too, next to
+    nginx.py.
+    """
+
+    def __init__(self, scope: Construct, id: str) -> None:
+        super().__init__(scope, id)
+
+        self._layer = LayerVersion(
+            self,
+            "Layer",
+            code=Code.from_asset("./lambdas/discovery-layer"),
+            compatible_runtimes=[Runtime.PYTHON_3_8],
+        )
+
+    @property
+    def layer(self):
+        return self._layer
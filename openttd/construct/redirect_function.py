@@ -0,0 +1,143 @@
+import json
+
+from aws_cdk.core import Construct
+from aws_cdk.aws_cloudfront import (
+    Function,
+    FunctionCode,
+)
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+# Viewer-request CloudFront Function; REDIRECTS is filled in at synth time.
+# CloudFront Functions run ES5.1, so keep to "var" and plain functions.
+FUNCTION_CODE = """
+var REDIRECTS = %s;
+
+// Query-string values arrive as the client sent them: URL-encoded.
+function decode(value) {
+    try {
+        return decodeURIComponent(value.replace(/\\+/g, " "));
+    } catch (e) {
+        return value;
+    }
+}
+
+function substitute(target, match, request, query) {
+    return target.replace(/\\$(\\d)|\\{(\\w+)\\}/g, function (_, group, name) {
+        if (group) return match[group] || "";
+        if (name === "uri") return request.uri;
+        return encodeURIComponent(query[name] || "");
+    });
+}
+
+function find(rules, request) {
+    for (var i = 0; i < rules.length; i++) {
+        var rule = rules[i];
+
+        var match = new RegExp(rule.path).exec(request.uri);
+        if (!match) continue;
+
+        var query = {};
+        for (var name in request.querystring) query[name] = decode(request.querystring[name].value);
+
+        var matched = true;
+        for (name in rule.query) {
+            if (query[name] === undefined || !new RegExp(rule.query[name]).test(query[name])) {
+                matched = false;
+                break;
+            }
+        }
+        if (!matched) continue;
+
+        for (name in rule.query_rewrites) {
+            if (query[name] === undefined) continue;
+            var rewrite = rule.query_rewrites[name];
+            query[name] = query[name].replace(new RegExp(rewrite[0], "g"), rewrite[1]);
+        }
+
+        return substitute(rule.target, match, request, query);
+    }
+
+    return null;
+}
+
+function handler(event) {
+    var request = event.request;
+    var host = request.headers.host ? request.headers.host.value.toLowerCase() : "";
+
+    var location = find(REDIRECTS[host] || [], request);
+    if (location === null) {
+        return {statusCode: 404, statusDescription: "Not Found"};
+    }
+
+    return {
+        statusCode: 301,
+        statusDescription: "Moved Permanently",
+        headers: {location: {value: location}},
+    };
+}
+"""
+
+
+class Redirect:
+    """
+    A single redirect rule; per host, the first rule that matches redirects.
+
+    - target: where to redirect to. "$1" .. "$9" are replaced by the groups
+      of "path", "{uri}" by the requested path, and any other "{name}" by
+      the value of that query-string parameter (URL-encoded again).
+    - path: regex (JavaScript flavour) the requested path has to match.
+    - query: per query-string parameter, a regex its (decoded) value has to
+      match; the parameter has to be present.
+    - query_rewrites: per query-string parameter, a (regex, replacement)
+      applied to its value before it is used in the target.
+    """
+
+    def __init__(
+        self,
+        target: str,
+        *,
+        path: str = "",
+        query: Optional[Dict[str, str]] = None,
+        query_rewrites: Optional[Dict[str, Tuple[str, str]]] = None,
+    ) -> None:
+        self.target = target
+        self.path = path
+        self.query = query or {}
+        self.query_rewrites = query_rewrites or {}
+
+    def to_dict(self) -> dict:
+        return {
+            "target": self.target,
+            "path": self.path,
+            "query": self.query,
+            "query_rewrites": {name: list(rewrite) for name, rewrite in self.query_rewrites.items()},
+        }
+
+
+def compile_redirects(redirects: Dict[str, List[Redirect]]) -> str:
+    """Compile the redirects (per FQDN) into the code of a CloudFront Function."""
+    table = {fqdn.lower(): [redirect.to_dict() for redirect in rules] for fqdn, rules in redirects.items()}
+    return FUNCTION_CODE % json.dumps(table, sort_keys=True)
+
+
+class RedirectFunction(Construct):
+    """
+    CloudFront Function that redirects based on a table of host/path rules.
+
+    It runs on viewer-request, so a redirect never reaches the cache or the
+    origin, and there is no cold start as with Lambda@Edge.
+    """
+
+    def __init__(self, scope: Construct, id: str, *, redirects: Dict[str, List[Redirect]]) -> None:
+        super().__init__(scope, id)
+
+        self.function = Function(
+            self,
+            "Function",
+            code=FunctionCode.from_inline(compile_redirects(redirects)),
+        )
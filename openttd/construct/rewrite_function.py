@@ -0,0 +1,95 @@
+import json
+
+from aws_cdk.core import Construct
+from aws_cdk.aws_cloudfront import (
+    Function,
+    FunctionAssociation,
+    FunctionCode,
+    FunctionEventType,
+)
+from typing import (
+    List,
+    Optional,
+)
+
+# Viewer-request CloudFront Function; REWRITES is filled in at synth time.
+# CloudFront Functions run ES5.1, so keep to "var" and plain functions.
+FUNCTION_CODE = """
+var REWRITES = %s.map(function (rewrite) {
+    return [new RegExp(rewrite[0]), rewrite[1]];
+});
+
+function handler(event) {
+    var request = event.request;
+
+    for (var i = 0; i < REWRITES.length; i++) {
+        if (REWRITES[i][0].test(request.uri)) {
+            request.uri = request.uri.replace(REWRITES[i][0], REWRITES[i][1]);
+            break;
+        }
+    }
+
+    return request;
+}
+"""
+
+
+class Rewrite:
+    """
+    A regex rewrite of the requested path; the first rewrite that matches is applied.
+
+    - pattern: regex (JavaScript flavour) the path has to match.
+    - replacement: what the matched part is replaced with; "$1" .. "$9" are
+      the groups of the pattern.
+    """
+
+    def __init__(self, pattern: str, replacement: str) -> None:
+        self.pattern = pattern
+        self.replacement = replacement
+
+
+# Serve "index.html" for folders, as S3 doesn't.
+INDEX_REWRITE = Rewrite("/$", "/index.html")
+
+
+def compile_rewrites(rewrites: List[Rewrite]) -> str:
+    """Compile the rewrites into the code of a CloudFront Function."""
+    return FUNCTION_CODE % json.dumps([[rewrite.pattern, rewrite.replacement] for rewrite in rewrites])
+
+
+class RewriteFunction(Construct):
+    """
+    CloudFront Function that rewrites the requested path.
+
+    It runs on viewer-request, so the cache is keyed on the rewritten path,
+    and there is no cold start as with Lambda@Edge.
+    """
+
+    def __init__(self, scope: Construct, id: str, *, rewrites: List[Rewrite]) -> None:
+        super().__init__(scope, id)
+
+        self.function = Function(
+            self,
+            "Function",
+            code=FunctionCode.from_inline(compile_rewrites(rewrites)),
+        )
+
+
+def add_rewrite_association(
+    scope: Construct, uri_rewrites: List[Rewrite], function_associations: Optional[List[FunctionAssociation]]
+) -> List[FunctionAssociation]:
+    """
+    Create a RewriteFunction in scope, and return the function associations with it added on viewer-request.
+    """
+    # CloudFront allows a single function per event type; don't wait for the deployment to find out.
+    if any(association.event_type == FunctionEventType.VIEWER_REQUEST for association in function_associations or []):
+        raise Exception("uri_rewrites can't be combined with a viewer-request function association")
+
+    # Rewritten on viewer-request, so the cache is keyed on the rewritten path.
+    rewrite_function = RewriteFunction(scope, "RewriteFunction", rewrites=uri_rewrites)
+    return (function_associations or []) + [
+        FunctionAssociation(
+            event_type=FunctionEventType.VIEWER_REQUEST,
+            function=rewrite_function.function,
+        ),
+    ]
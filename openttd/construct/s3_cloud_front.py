@@ -8,6 +8,7 @@ from aws_cdk.aws_cloudfront import (
     Behavior,
     CfnDistribution,
     CloudFrontWebDistribution,
+    FunctionAssociation,
     LambdaFunctionAssociation,
     LoggingConfiguration,
     OriginAccessIdentity,
@@ -36,6 +37,10 @@ from openttd.construct.dns import (
     ARecord,
     AaaaRecord,
 )
+from openttd.construct.rewrite_function import (
+    Rewrite,
+    add_rewrite_association,
+)
 from openttd.stack.common import certificate
 
 
@@ -50,6 +55,8 @@ class S3CloudFront(Construct):
         cert: Optional[certificate.CertificateResult] = None,
         error_folder: Optional[str] = None,
         lambda_function_associations: Optional[List[LambdaFunctionAssociation]] = None,
+        function_associations: Optional[List[FunctionAssociation]] = None,
+        uri_rewrites: Optional[List[Rewrite]] = None,
         bucket_site: Optional[Bucket] = None,
         bucket_access_logs: Optional[Bucket] = None,
         price_class: Optional[PriceClass] = PriceClass.PRICE_CLASS_100,
@@ -100,6 +107,9 @@ class S3CloudFront(Construct):
                 ),
             ]
 
+        if uri_rewrites:
+            function_associations = add_rewrite_association(self, uri_rewrites, function_associations)
+
         self.distribution = CloudFrontWebDistribution(
             self,
             "CloudFront",
@@ -113,6 +123,7 @@ class S3CloudFront(Construct):
                         Behavior(
                             is_default_behavior=True,
                             lambda_function_associations=lambda_function_associations,
+                            function_associations=function_associations,
                         )
                     ],
                 )
@@ -6,6 +6,7 @@ from aws_cdk.aws_cloudfront import (
     Distribution,
     EdgeLambda,
     ErrorResponse,
+    FunctionAssociation,
     PriceClass,
     ViewerProtocolPolicy,
 )
@@ -25,6 +26,10 @@ from openttd.construct.dns import (
     ARecord,
     AaaaRecord,
 )
+from openttd.construct.rewrite_function import (
+    Rewrite,
+    add_rewrite_association,
+)
 from openttd.stack.common import certificate
 
 
@@ -39,6 +44,8 @@ class S3CloudFrontV2(Construct):
         error_folder: Optional[str] = None,
         forward_query_string_cache_keys: Optional[List[str]] = None,
         edge_lambdas: Optional[List[EdgeLambda]] = None,
+        function_associations: Optional[List[FunctionAssociation]] = None,
+        uri_rewrites: Optional[List[Rewrite]] = None,
         bucket_site: Optional[Bucket] = None,
         bucket_access_logs: Optional[Bucket] = None,
         price_class: Optional[PriceClass] = PriceClass.PRICE_CLASS_100,
@@ -78,6 +85,9 @@ class S3CloudFrontV2(Construct):
                 )
             ]
 
+        if uri_rewrites:
+            function_associations = add_rewrite_association(self, uri_rewrites, function_associations)
+
         if forward_query_string_cache_keys is None:
             query_string_behaviour = CacheQueryStringBehavior.none()
         else:
@@ -92,6 +102,7 @@ class S3CloudFrontV2(Construct):
                 ),
                 viewer_protocol_policy=viewer_protocol_policy,
                 edge_lambdas=edge_lambdas,
+                function_associations=function_associations,
                 cache_policy=CachePolicy(
                     self,
                     "CachePolicy",
@@ -9,3 +9,25 @@ class Maturity(Enum):
 class Deployment(Enum):
     STAGING = "Staging"
     PRODUCTION = "Production"
+
+
+class NlbBalance(Enum):
+    HASH = "hash"
+    LEAST_CONN = "least_conn"
+    RANDOM = "random"
+    ROUND_ROBIN = "round_robin"
+
+
+class NlbProxyProtocol(Enum):
+    V1 = "v1"
+    OFF = "off"
+
+
+class SocksBackend(Enum):
+    PPROXY = "pproxy"
+    THREEPROXY = "3proxy"
+
+
+class ReloadMode(Enum):
+    PARALLEL = "parallel"
+    ROLLING = "rolling"
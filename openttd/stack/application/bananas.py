@@ -6,8 +6,6 @@ from aws_cdk.core import (
     Tags,
 )
 from aws_cdk.aws_cloudfront import (
-    LambdaEdgeEventType,
-    LambdaFunctionAssociation,
     PriceClass,
     ViewerProtocolPolicy,
 )
@@ -36,16 +34,20 @@ from typing import (
     Optional,
 )
 
+from openttd.construct.discovery_layer import DiscoveryLayer
 from openttd.construct.ecs_https_container import ECSHTTPSContainer
 from openttd.construct.policy import Policy
+from openttd.construct.rewrite_function import Rewrite
 from openttd.construct.s3_cloud_front import (
     S3CloudFront,
     S3CloudFrontPolicy,
 )
-from openttd.enumeration import Deployment
+from openttd.enumeration import (
+    Deployment,
+    ReloadMode,
+)
 from openttd.stack.common import (
     dns,
-    lambda_edge,
     nlb_self as nlb,
     parameter_store,
 )
@@ -69,23 +71,20 @@ class BananasCdnStack(Stack):
         Tags.of(self).add("Application", self.application_name)
         Tags.of(self).add("Deployment", deployment.value)
 
-        func = lambda_edge.create_function(
-            self,
-            f"BananasCdnRedirect{deployment.value}",
-            runtime=Runtime.NODEJS_10_X,
-            handler="index.handler",
-            code=Code.from_asset("./lambdas/bananas-cdn"),
-        )
-
         s3_cloud_front = S3CloudFront(
             self,
             "S3CloudFront",
             subdomain_name=self.subdomain_name,
             error_folder="/errors",
-            lambda_function_associations=[
-                LambdaFunctionAssociation(
-                    event_type=LambdaEdgeEventType.ORIGIN_REQUEST,
-                    lambda_function=func,
+            uri_rewrites=[
+                # Rewrite the first to the second:
+                #   base-graphics/12345678/12345678901234567890123456789012/filename.tar.gz
+                #   base-graphics/12345678/12345678901234567890123456789012.tar.gz
+                # This allows the OpenTTD client to know the name to use for the file,
+                #   while the S3 only knows the md5sum based name.
+                Rewrite(
+                    r"^/([a-z-]+)/([a-f0-9]{8})/([a-f0-9]{32})/[a-zA-Z0-9-_\.]+.tar.gz$",
+                    "/$1/$2/$3.tar.gz",
                 ),
             ],
             price_class=PriceClass.PRICE_CLASS_ALL,
@@ -407,6 +406,8 @@ class BananasReload(Stack):
         service: IEc2Service,
         ecs_security_group: SecurityGroup,
         deployment: Deployment,
+        reload_mode: ReloadMode = ReloadMode.PARALLEL,
+        reload_batch_size: int = 1,
         **kwargs,
     ) -> None:
         super().__init__(scope, id, **kwargs)
@@ -427,9 +428,13 @@ class BananasReload(Stack):
             handler="index.lambda_handler",
             runtime=Runtime.PYTHON_3_8,
             timeout=Duration.seconds(120),
+            layers=[DiscoveryLayer(self, "DiscoveryLayer").layer],
             environment={
                 "CLUSTER": cluster.cluster_arn,
                 "SERVICE": service.service_arn,
+                # How the tasks are reloaded; with "rolling", a batch at the time.
+                "RELOAD_MODE": reload_mode.value,
+                "RELOAD_BATCH_SIZE": str(reload_batch_size),
             },
             vpc=vpc,
             security_groups=[security_group, ecs_security_group],
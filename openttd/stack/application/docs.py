@@ -3,21 +3,13 @@ from aws_cdk.core import (
     Stack,
     Tags,
 )
-from aws_cdk.aws_cloudfront import (
-    LambdaEdgeEventType,
-    LambdaFunctionAssociation,
-)
-from aws_cdk.aws_lambda import (
-    Code,
-    Runtime,
-)
 
+from openttd.construct.rewrite_function import INDEX_REWRITE
 from openttd.construct.s3_cloud_front import (
     S3CloudFront,
     S3CloudFrontPolicy,
 )
 from openttd.enumeration import Deployment
-from openttd.stack.common import lambda_edge
 
 
 class DocsStack(Stack):
@@ -30,25 +22,12 @@ class DocsStack(Stack):
         Tags.of(self).add("Application", self.application_name)
         Tags.of(self).add("Deployment", deployment.value)
 
-        func = lambda_edge.create_function(
-            self,
-            "DocsIndexRedirect",
-            runtime=Runtime.NODEJS_10_X,
-            handler="index.handler",
-            code=Code.from_asset("./lambdas/index-redirect"),
-        )
-
         s3_cloud_front = S3CloudFront(
             self,
             "S3CloudFront",
             subdomain_name=self.subdomain_name,
             error_folder="/errors",
-            lambda_function_associations=[
-                LambdaFunctionAssociation(
-                    event_type=LambdaEdgeEventType.ORIGIN_REQUEST,
-                    lambda_function=func,
-                ),
-            ],
+            uri_rewrites=[INDEX_REWRITE],
         )
 
         S3CloudFrontPolicy(
@@ -1,5 +1,6 @@
 from aws_cdk.core import (
     Construct,
+    Duration,
     Stack,
     Tags,
 )
@@ -12,7 +13,10 @@ from aws_cdk.aws_ec2 import Port
 from openttd.construct.ecs_https_container import ECSHTTPSContainer
 from openttd.construct.image_from_parameter_store import ImageFromParameterStore
 from openttd.construct.policy import Policy
-from openttd.enumeration import Deployment
+from openttd.enumeration import (
+    Deployment,
+    NlbBalance,
+)
 from openttd.stack.common import (
     dns,
     nlb_self as nlb,
@@ -85,7 +89,19 @@ class GameCoordinatorStack(Stack):
         )
 
         self.container.add_port(coordinator_port)
-        nlb.add_nlb(self, self.container.service, Port.tcp(coordinator_port), self.nlb_subdomain_name, "Game Coordinator")
+        # Clients of the Game Coordinator hold long-lived connections; spread
+        # them by load, as with hashing a busy (CG)NAT pins a lot of players
+        # on a single task.
+        nlb.add_nlb(
+            self,
+            self.container.service,
+            Port.tcp(coordinator_port),
+            self.nlb_subdomain_name,
+            "Game Coordinator",
+            balance=NlbBalance.LEAST_CONN,
+            max_fails=1,
+            fail_timeout=Duration.seconds(30),
+        )
 
 
 class StunServerStack(Stack):
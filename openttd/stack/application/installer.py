@@ -4,26 +4,20 @@ from aws_cdk.core import (
     Tags,
 )
 from aws_cdk.aws_cloudfront import (
-    LambdaEdgeEventType,
-    LambdaFunctionAssociation,
     PriceClass,
     ViewerProtocolPolicy,
 )
-from aws_cdk.aws_lambda import (
-    Code,
-    Runtime,
-)
 from typing import (
     List,
     Optional,
 )
 
+from openttd.construct.rewrite_function import INDEX_REWRITE
 from openttd.construct.s3_cloud_front import (
     S3CloudFront,
     S3CloudFrontPolicy,
 )
 from openttd.enumeration import Deployment
-from openttd.stack.common import lambda_edge
 
 
 class InstallerStack(Stack):
@@ -36,25 +30,12 @@ class InstallerStack(Stack):
         Tags.of(self).add("Application", self.application_name)
         Tags.of(self).add("Deployment", deployment.value)
 
-        func = lambda_edge.create_function(
-            self,
-            "InstallerCdnIndexRedirect",
-            runtime=Runtime.NODEJS_10_X,
-            handler="index.handler",
-            code=Code.from_asset("./lambdas/index-redirect"),
-        )
-
         s3_cloud_front = S3CloudFront(
             self,
             "S3CloudFront",
             subdomain_name=self.subdomain_name,
             error_folder="/errors",
-            lambda_function_associations=[
-                LambdaFunctionAssociation(
-                    event_type=LambdaEdgeEventType.ORIGIN_REQUEST,
-                    lambda_function=func,
-                ),
-            ],
+            uri_rewrites=[INDEX_REWRITE],
             additional_fqdns=additional_fqdns,
             price_class=PriceClass.PRICE_CLASS_ALL,
             viewer_protocol_policy=ViewerProtocolPolicy.ALLOW_ALL,  # NSIS doesn't support HTTPS
@@ -192,7 +192,16 @@ class MasterServerStack(Stack):
         )
 
         self.container.add_udp_port(master_port)
-        nlb.add_nlb(self, self.container.service, Port.udp(master_port), self.nlb_subdomain_name, "Master Server")
+        # Server-list refreshes are bursts of single datagrams, each answered
+        # by a single datagram.
+        nlb.add_nlb(
+            self,
+            self.container.service,
+            Port.udp(master_port),
+            self.nlb_subdomain_name,
+            "Master Server",
+            udp_stateless=True,
+        )
 
 
 class MasterServerWebStack(Stack):
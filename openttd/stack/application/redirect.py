@@ -4,41 +4,112 @@ from aws_cdk.core import (
     Tags,
 )
 from aws_cdk.aws_cloudfront import (
-    EdgeLambda,
-    LambdaEdgeEventType,
-    LambdaFunctionAssociation,
-)
-from aws_cdk.aws_lambda import (
-    Code,
-    Runtime,
+    FunctionAssociation,
+    FunctionEventType,
 )
+from aws_cdk.aws_route53_targets import CloudFrontTarget
 from aws_cdk.aws_s3 import (
     BlockPublicAccess,
     Bucket,
     BucketEncryption,
 )
 
-from openttd.construct.s3_cloud_front import S3CloudFront
+from openttd.construct.dns import (
+    ARecord,
+    AaaaRecord,
+)
+from openttd.construct.redirect_function import (
+    Redirect,
+    RedirectFunction,
+)
 from openttd.construct.s3_cloud_front_v2 import S3CloudFrontV2
 from openttd.enumeration import Deployment
-from openttd.stack.common import lambda_edge
+from openttd.stack.common import dns
 
 
 class RedirectStack(Stack):
+    """
+    All subdomains that only redirect elsewhere.
+
+    They share a single CloudFront distribution; a CloudFront Function,
+    compiled from the table below, answers every request with a redirect.
+
+    Migrating from a deployment with a distribution per subdomain (the
+    "S3CloudFront-<subdomain>" constructs, with a Lambda@Edge function each)
+    can't be done by an in-place update: CloudFront refuses an alias that
+    another distribution still holds (CNAMEAlreadyExists), and Route53
+    refuses the records of the old distributions ("already exists"). Per
+    deployment (Staging first, then Production):
+
+    1. With the previous version checked out, remove the old distributions
+       and their records:
+         cdk destroy <maturity>-<deployment>-Redirect
+       The "Site" and "AccessLogs" buckets are retained; empty and delete
+       them by hand afterwards.
+    2. Directly after, deploy this version as usual. The certificate stack
+       replaces the certificate of the first subdomain with one that lists
+       all subdomains, and the Lambda@Edge stack drops the old redirect
+       functions.
+    3. Lambda@Edge replicas live on for a few hours after their distribution
+       is gone, so their removal in step 2 can fail; delete the leftover
+       "Redirect-<subdomain>-<deployment>" functions in us-east-1 by hand
+       once CloudFront released them.
+
+    None of the redirect subdomains resolve from the start of step 1 until
+    the new distribution finished deploying in step 2; expect 30 to 60
+    minutes, most of it CloudFront disabling, deleting and creating
+    distributions.
+    """
+
     application_name = "Redirect"
-    subdomain_names = [
-        "download",
-        "farm",
-        "forum",
-        "github",
-        "grfsearch",
-        "nightly",
-        "noai",
-        "nogo",
-        "proxy.binaries",
-        "root",
-        "security",
-    ]
+    # Per subdomain, the rules are tried in order; see Redirect for the syntax.
+    redirects = {
+        "download": [
+            Redirect("https://www.openttd.org/downloads/openttd-nightlies/latest.html"),
+        ],
+        "farm": [
+            Redirect("https://dev.azure.com/openttd/OpenTTD/_build"),
+        ],
+        "forum": [
+            Redirect("https://www.tt-forums.net/viewforum.php?f=55"),
+        ],
+        "github": [
+            Redirect("https://github.com/OpenTTD/OpenTTD"),
+        ],
+        "grfsearch": [
+            Redirect(
+                "https://grfcrawler.tt-forums.net/index.php?do=search&q={q}",
+                query={"do": "^searchtext$", "q": ".+"},
+            ),
+            Redirect(
+                "https://grfcrawler.tt-forums.net/index.php?do=search&type=grfidlist&q={q}",
+                query={"do": "^searchgrfid$", "q": ".+"},
+                # grfcrawler does not support md5sum, so remove them from the query.
+                query_rewrites={"q": (":[0-9A-Fa-f]*", "")},
+            ),
+            Redirect("https://grfcrawler.tt-forums.net/index.php"),
+        ],
+        "nightly": [
+            Redirect("https://www.openttd.org/downloads/openttd-releases/latest.html"),
+        ],
+        "noai": [
+            Redirect("https://docs.openttd.org/ai-api/"),
+        ],
+        "nogo": [
+            Redirect("https://docs.openttd.org/gs-api/"),
+        ],
+        "proxy.binaries": [
+            Redirect("https://cdn.openttd.org{uri}"),
+        ],
+        "root": [
+            Redirect("https://www.openttd.org/"),
+        ],
+        "security": [
+            Redirect("https://www.openttd.org/security/CVE-$1-$2.html", path="^(?:/en)?/CVE-([0-9]+)-([0-9]+)$"),
+            # We have no clue what the user tried to visit, so just point to the main page.
+            Redirect("https://www.openttd.org/security.html"),
+        ],
+    }
 
     def __init__(self, scope: Construct, id: str, *, deployment: Deployment, **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
@@ -59,41 +130,41 @@ class RedirectStack(Stack):
             block_public_access=BlockPublicAccess.BLOCK_ALL,
         )
 
-        for subdomain_name in self.subdomain_names:
-            func_version = lambda_edge.create_function(
+        redirect_function = RedirectFunction(
+            self,
+            "RedirectFunction",
+            redirects={dns.subdomain_to_fqdn(subdomain_name): redirects for subdomain_name, redirects in self.redirects.items()},
+        )
+
+        # The first subdomain names the certificate; the others are aliases.
+        subdomain_names = list(self.redirects)
+        additional_fqdns = [dns.subdomain_to_fqdn(subdomain_name) for subdomain_name in subdomain_names[1:]]
+
+        s3_cloud_front = S3CloudFrontV2(
+            self,
+            "S3CloudFront",
+            subdomain_name=subdomain_names[0],
+            additional_fqdns=additional_fqdns,
+            bucket_site=bucket_site,
+            bucket_access_logs=bucket_access_logs,
+            function_associations=[
+                FunctionAssociation(
+                    event_type=FunctionEventType.VIEWER_REQUEST,
+                    function=redirect_function.function,
+                ),
+            ],
+        )
+
+        for fqdn in additional_fqdns:
+            ARecord(
                 self,
-                f"Redirect-{subdomain_name}-{deployment.value}",
-                runtime=Runtime.NODEJS_10_X,
-                handler="index.handler",
-                code=Code.from_asset(f"./lambdas/redirect-{subdomain_name}"),
+                f"{fqdn}-ARecord",
+                fqdn=fqdn,
+                target=CloudFrontTarget(s3_cloud_front.distribution),
+            )
+            AaaaRecord(
+                self,
+                f"{fqdn}-AaaaRecord",
+                fqdn=fqdn,
+                target=CloudFrontTarget(s3_cloud_front.distribution),
             )
-
-            if subdomain_name == "grfsearch":
-                S3CloudFrontV2(
-                    self,
-                    f"S3CloudFront-{subdomain_name}",
-                    subdomain_name=subdomain_name,
-                    bucket_site=bucket_site,
-                    bucket_access_logs=bucket_access_logs,
-                    edge_lambdas=[
-                        EdgeLambda(
-                            event_type=LambdaEdgeEventType.ORIGIN_REQUEST,
-                            function_version=func_version,
-                        ),
-                    ],
-                    forward_query_string_cache_keys=["do", "q"],
-                )
-            else:
-                S3CloudFront(
-                    self,
-                    f"S3CloudFront-{subdomain_name}",
-                    subdomain_name=subdomain_name,
-                    bucket_site=bucket_site,
-                    bucket_access_logs=bucket_access_logs,
-                    lambda_function_associations=[
-                        LambdaFunctionAssociation(
-                            event_type=LambdaEdgeEventType.ORIGIN_REQUEST,
-                            lambda_function=func_version,
-                        ),
-                    ],
-                )
@@ -26,9 +26,13 @@ from aws_cdk.aws_lambda import (
     Runtime,
 )
 
+from openttd.construct.discovery_layer import DiscoveryLayer
 from openttd.construct.ecs_https_container import ECSHTTPSContainer
 from openttd.construct.policy import Policy
-from openttd.enumeration import Deployment
+from openttd.enumeration import (
+    Deployment,
+    ReloadMode,
+)
 from openttd.stack.common import parameter_store
 
 
@@ -150,6 +154,8 @@ class WikiReload(Stack):
         service: IEc2Service,
         ecs_security_group: SecurityGroup,
         deployment: Deployment,
+        reload_mode: ReloadMode = ReloadMode.PARALLEL,
+        reload_batch_size: int = 1,
         **kwargs,
     ) -> None:
         super().__init__(scope, id, **kwargs)
@@ -170,9 +176,13 @@ class WikiReload(Stack):
             handler="index.lambda_handler",
             runtime=Runtime.PYTHON_3_8,
             timeout=Duration.seconds(120),
+            layers=[DiscoveryLayer(self, "DiscoveryLayer").layer],
             environment={
                 "CLUSTER": cluster.cluster_arn,
                 "SERVICE": service.service_arn,
+                # How the tasks are reloaded; with "rolling", a batch at the time.
+                "RELOAD_MODE": reload_mode.value,
+                "RELOAD_BATCH_SIZE": str(reload_batch_size),
             },
             vpc=vpc,
             security_groups=[security_group, ecs_security_group],
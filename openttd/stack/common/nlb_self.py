@@ -4,14 +4,16 @@ IPv6. This is the only reason, so as soon as it does, this module should be
 deprecated.
 
 How the NLB is created:
-- ASG with EC2 t3a.nano over two AZs
+- ASG with EC2 t3a.nano over two AZs, scaling on network traffic and surplus CPU credits
   - EC2 with UserData, installs:
     - nginx
     - Python script to generate config
+    - SOCKS proxy for egress of ECS services (pproxy TCP workers or 3proxy, and a single pproxy for UDP)
 - Lifecycle Hook on ASG to Lambda
 - Lambda responds to scale up/down, updates DNS record with external IPv4 and IPv6
-- CloudWatch event on ECS change to Lambda
-- Lambda calls Python script on EC2 instances via RunCommand
+- CloudWatch event on ECS change to SQS, which batches them to Lambda
+- Lambda hands the changes to the Python script on EC2 instances via RunCommand
+- Python script on EC2 exports the traffic per listener as CloudWatch metrics
 
 In the end we have:
   content.openttd.org     CNAME       nlb.openttd.org
@@ -21,8 +23,22 @@ In the end we have:
   nlb.openttd.org         AAAA        <IPv6 of EC2-2>
 
 On ASG scale, Lambda updates the above IPs.
-On ECS mutation, Lambda calls Python script on EC2-1 and EC2-2.
-This results in a new nginx config, which is reloaded.
+On ECS mutation, the changes are collected for a short window. After that,
+Lambda drops the changes of services behind the NLB in the spool folder of
+EC2-1 and EC2-2. The Python script runs as daemon, keeps the topology in
+memory, and only writes (and reloads) a new nginx config if the change
+affects it.
+
+With a central topology (the default), Lambda does the discovery once for
+all instances, and publishes the result as a versioned object in S3. In the
+spool folder it only tells the instances to fetch this new version. This
+means adding NLB instances doesn't add ECS API calls, and all instances
+render the same topology. On a schedule, Lambda also does a full publish,
+so a change it missed is healed.
+
+Every instance keeps the last topology it rendered on disk, and boots from
+it (or from the topology in S3) before it consults the AWS APIs. This way
+an instance is quickly ready, and keeps serving if these APIs fail.
 """
 
 import jsii
@@ -31,15 +47,20 @@ from aws_cdk.core import (
     Construct,
     Duration,
     Stack,
+    SymlinkFollowMode,
     Tags,
 )
 from aws_cdk.aws_autoscaling import (
+    AdjustmentType,
     AutoScalingGroup,
     DefaultResult,
     HealthCheck,
     LifecycleTransition,
+    Monitoring,
+    ScalingInterval,
 )
 from aws_cdk.aws_autoscaling_hooktargets import FunctionHook
+from aws_cdk.aws_cloudwatch import Metric
 from aws_cdk.aws_ec2 import (
     AmazonLinuxGeneration,
     InstanceType,
@@ -59,8 +80,12 @@ from aws_cdk.aws_ecs import (
 from aws_cdk.aws_events import (
     EventPattern,
     Rule,
+    Schedule,
+)
+from aws_cdk.aws_events_targets import (
+    LambdaFunction,
+    SqsQueue,
 )
-from aws_cdk.aws_events_targets import LambdaFunction
 from aws_cdk.aws_iam import (
     ManagedPolicy,
     PolicyStatement,
@@ -70,6 +95,11 @@ from aws_cdk.aws_lambda import (
     Function,
     Runtime,
 )
+from aws_cdk.aws_lambda_event_sources import SqsEventSource
+from aws_cdk.aws_logs import (
+    LogGroup,
+    RetentionDays,
+)
 from aws_cdk.aws_route53 import (
     ARecord,
     AaaaRecord,
@@ -77,9 +107,21 @@ from aws_cdk.aws_route53 import (
     IAliasRecordTarget,
     RecordTarget,
 )
+from aws_cdk.aws_s3 import (
+    BlockPublicAccess,
+    Bucket,
+    LifecycleRule,
+)
 from aws_cdk.aws_s3_assets import Asset
+from aws_cdk.aws_sqs import Queue
 from typing import Optional
 
+from openttd.construct.discovery_layer import DiscoveryLayer
+from openttd.enumeration import (
+    NlbBalance,
+    NlbProxyProtocol,
+    SocksBackend,
+)
 from openttd.stack.common import (
     dns,
     listener_https,
@@ -103,6 +145,8 @@ class DomainAlias:
 class NlbStack(Stack):
     admin_subdomain_name = "nlb-health"
     subdomain_name = "nlb"
+    topology_key = "topology.json"
+    dns_ttl = Duration.seconds(60)
 
     def __init__(
         self,
@@ -112,6 +156,14 @@ class NlbStack(Stack):
         ecs_security_group: SecurityGroup,
         ecs_source_security_group: SecurityGroup,
         vpc: IVpc,
+        ecs_event_window: Duration = Duration.seconds(10),
+        central_topology: bool = True,
+        topology_resync_interval: Duration = Duration.minutes(5),
+        drain_timeout: Duration = Duration.minutes(10),
+        drain_connections: int = 0,
+        max_capacity: int = 6,
+        socks_backend: SocksBackend = SocksBackend.PPROXY,
+        socks_workers: int = 2,
         **kwargs,
     ) -> None:
         super().__init__(scope, id, **kwargs)
@@ -133,7 +185,8 @@ class NlbStack(Stack):
 
         user_data = UserData.for_linux(shebang="#!/bin/bash -ex")
 
-        asset = Asset(self, "NLB", path="user_data/nlb/")
+        # discovery.py is a symlink to the module shared with the Lambdas.
+        asset = Asset(self, "NLB", path="user_data/nlb/", follow_symlinks=SymlinkFollowMode.ALWAYS)
         user_data.add_commands(
             "echo 'Extracting user-data files'",
             "mkdir /nlb",
@@ -154,12 +207,49 @@ class NlbStack(Stack):
             f"echo '{cluster.cluster_name}' > /etc/.cluster",
         )
 
+        # Holds the topology; either as published by the nlb-ecs Lambda, or
+        # as mirrored by the instances themselves. Either way, new instances
+        # boot from it.
+        topology_bucket = Bucket(
+            self,
+            "Topology",
+            block_public_access=BlockPublicAccess.BLOCK_ALL,
+            versioned=True,
+            # Every publish is a new version; only the recent ones are of
+            # any use when looking back.
+            lifecycle_rules=[
+                LifecycleRule(
+                    noncurrent_version_expiration=Duration.days(7),
+                ),
+            ],
+        )
+        topology_url = f"s3://{topology_bucket.bucket_name}/{self.topology_key}"
+        if central_topology:
+            user_data.add_commands(f"echo '{topology_url}' > /etc/.topology-url")
+        else:
+            user_data.add_commands(f"echo '{topology_url}' > /etc/.topology-mirror-url")
+
+        # The traffic per listener is sent here by exporter.py, as metrics.
+        metrics_log_group = LogGroup(
+            self,
+            "Metrics",
+            retention=RetentionDays.ONE_WEEK,
+        )
+        user_data.add_commands(
+            f"echo '{metrics_log_group.log_group_name}' > /etc/.metrics-log-group",
+        )
+
         user_data.add_commands(
             "echo 'Installing nginx'",
             "amazon-linux-extras install epel",
             "yum install nginx nginx-mod-stream -y",
             "cp /nlb/nginx.conf /etc/nginx/nginx.conf",
             "mkdir /etc/nginx/nlb.d",
+            "mkdir /var/spool/nlb",
+            "mkdir /var/lib/nlb",
+            # The backlog of the NLB listeners is capped by this.
+            "echo 'net.core.somaxconn = 4096' > /etc/sysctl.d/90-nlb.conf",
+            "sysctl --system",
         )
 
         user_data.add_commands(
@@ -177,17 +267,23 @@ class NlbStack(Stack):
         )
 
         user_data.add_commands(
-            "echo 'Setting up TCP and UDP SOCKS proxy'",
-            "useradd pproxy",
-            "cp /nlb/pproxy-tcp.service /etc/systemd/system/",
-            "cp /nlb/pproxy-udp.service /etc/systemd/system/",
+            "echo 'Setting up nginx configuration daemon'",
+            "cp /nlb/nlb-nginx.service /etc/systemd/system/",
             "systemctl daemon-reload",
-            "systemctl enable pproxy-tcp.service",
-            "systemctl enable pproxy-udp.service",
-            "systemctl start pproxy-tcp.service",
-            "systemctl start pproxy-udp.service",
+            "systemctl enable nlb-nginx.service",
+            "systemctl start nlb-nginx.service",
+        )
+
+        user_data.add_commands(
+            "echo 'Setting up traffic metrics exporter'",
+            "cp /nlb/nlb-exporter.service /etc/systemd/system/",
+            "systemctl daemon-reload",
+            "systemctl enable nlb-exporter.service",
+            "systemctl start nlb-exporter.service",
         )
 
+        self.setup_socks_proxy(user_data, socks_backend, socks_workers)
+
         asg = AutoScalingGroup(
             self,
             "ASG",
@@ -195,23 +291,32 @@ class NlbStack(Stack):
             instance_type=InstanceType("t3a.nano"),
             machine_image=MachineImage.latest_amazon_linux(generation=AmazonLinuxGeneration.AMAZON_LINUX_2),
             min_capacity=2,
+            max_capacity=max_capacity,
+            # Scaling reacts to 1-minute metrics instead of 5-minute ones.
+            instance_monitoring=Monitoring.DETAILED,
             vpc_subnets=SubnetSelection(subnet_type=SubnetType.PUBLIC, one_per_az=True),
             user_data=user_data,
             health_check=HealthCheck.elb(grace=Duration.seconds(0)),
         )
         asg.add_security_group(ecs_security_group)
+        self.create_scaling_policies(asg)
 
         asg.role.add_managed_policy(ManagedPolicy.from_aws_managed_policy_name("AmazonSSMManagedInstanceCore"))
         asset.grant_read(asg.role)
+        metrics_log_group.grant_write(asg.role)
+        if central_topology:
+            topology_bucket.grant_read(asg.role)
+        else:
+            topology_bucket.grant_read_write(asg.role)
         policy = ManagedPolicy(self, "Policy")
         policy_statement = PolicyStatement(
             actions=[
                 "ec2:DescribeInstances",
                 "ecs:DescribeContainerInstances",
+                "ecs:DescribeServices",
                 "ecs:DescribeTasks",
                 "ecs:ListContainerInstances",
                 "ecs:ListServices",
-                "ecs:ListTagsForResource",
                 "ecs:ListTasks",
             ],
             resources=["*"],
@@ -234,7 +339,9 @@ class NlbStack(Stack):
         )
 
         # Create a Security Group so the lambdas can access the EC2.
-        # This is needed to check if the EC2 instance is fully booted.
+        # This is needed to check if the EC2 instance is fully booted and
+        # has rendered its upstreams (see /readyz in nginx.conf), and to
+        # check if it is drained before termination (see /connections).
         lambda_security_group = SecurityGroup(
             self,
             "LambdaSG",
@@ -281,6 +388,9 @@ class NlbStack(Stack):
         self.create_ecs_lambda(
             cluster=cluster,
             auto_scaling_group=asg,
+            window=ecs_event_window,
+            topology_bucket=topology_bucket if central_topology else None,
+            resync_interval=topology_resync_interval,
         )
 
         self.create_asg_lambda(
@@ -289,13 +399,18 @@ class NlbStack(Stack):
             vpc=vpc,
             security_group=lambda_security_group,
             auto_scaling_group=asg,
+            drain_connections=drain_connections,
         )
+        # Terminating waits for Route53 to be in sync, for the DNS TTL to
+        # expire, and for the active connections to drain, before the
+        # instance is allowed to go.
         self.create_asg_lambda(
             lifecycle_transition=LifecycleTransition.INSTANCE_TERMINATING,
-            timeout=Duration.seconds(30),
+            timeout=drain_timeout,
             vpc=vpc,
             security_group=lambda_security_group,
             auto_scaling_group=asg,
+            drain_connections=drain_connections,
         )
 
         # Initialize the NLB record on localhost, as we need to be able to
@@ -306,7 +421,7 @@ class NlbStack(Stack):
             target=RecordTarget.from_ip_addresses("127.0.0.1"),
             zone=dns.get_hosted_zone(),
             record_name=self.subdomain_name,
-            ttl=Duration.seconds(60),
+            ttl=self.dns_ttl,
         )
         AaaaRecord(
             self,
@@ -314,7 +429,7 @@ class NlbStack(Stack):
             target=RecordTarget.from_ip_addresses("::1"),
             zone=dns.get_hosted_zone(),
             record_name=self.subdomain_name,
-            ttl=Duration.seconds(60),
+            ttl=self.dns_ttl,
         )
         # To make things a bit easier, also alias to staging.
         self.create_alias(self, "nlb.staging")
@@ -326,7 +441,7 @@ class NlbStack(Stack):
             target=RecordTarget.from_ip_addresses("127.0.0.1"),
             zone=self.private_zone,
             record_name=self.subdomain_name,
-            ttl=Duration.seconds(60),
+            ttl=self.dns_ttl,
         )
 
         if g_nlb is not None:
@@ -349,24 +464,44 @@ class NlbStack(Stack):
             record_name=dns.subdomain_to_fqdn(subdomain_name),
         )
 
-    def create_ecs_lambda(self, cluster: ICluster, auto_scaling_group: AutoScalingGroup):
+    def create_ecs_lambda(
+        self,
+        cluster: ICluster,
+        auto_scaling_group: AutoScalingGroup,
+        window: Duration,
+        topology_bucket: Optional[Bucket],
+        resync_interval: Duration,
+    ):
+        timeout = Duration.seconds(30)
+
+        environment = {
+            "AUTO_SCALING_GROUP_NAME": auto_scaling_group.auto_scaling_group_name,
+            "CLUSTER": cluster.cluster_arn,
+        }
+        if topology_bucket:
+            environment["TOPOLOGY_BUCKET"] = topology_bucket.bucket_name
+            environment["TOPOLOGY_KEY"] = self.topology_key
+
         lambda_func = Function(
             self,
             "LambdaECS",
             code=Code.from_asset("./lambdas/nlb-ecs"),
             handler="index.lambda_handler",
             runtime=Runtime.PYTHON_3_8,
-            timeout=Duration.seconds(30),
-            environment={
-                "AUTO_SCALING_GROUP_NAME": auto_scaling_group.auto_scaling_group_name,
-            },
+            layers=[DiscoveryLayer(self, "DiscoveryLayer").layer],
+            timeout=timeout,
+            environment=environment,
+            # Only one window is processed at the time; this means the
+            # instances never get overlapping RunCommands.
+            reserved_concurrent_executions=1,
         )
         lambda_func.add_to_role_policy(
             PolicyStatement(
                 actions=[
                     "autoscaling:DescribeAutoScalingGroups",
+                    "ecs:DescribeServices",
                     "ssm:SendCommand",
-                    "ssm:GetCommandInvocation",
+                    "ssm:ListCommandInvocations",
                 ],
                 resources=[
                     "*",
@@ -374,6 +509,40 @@ class NlbStack(Stack):
             )
         )
 
+        if topology_bucket:
+            topology_bucket.grant_read_write(lambda_func)
+            lambda_func.add_to_role_policy(
+                PolicyStatement(
+                    actions=[
+                        "ec2:DescribeInstances",
+                        "ecs:DescribeContainerInstances",
+                        "ecs:DescribeTasks",
+                        "ecs:ListContainerInstances",
+                        "ecs:ListServices",
+                        "ecs:ListTasks",
+                    ],
+                    resources=[
+                        "*",
+                    ],
+                )
+            )
+
+        # A rolling deploy results in dozens of events in a short time. The
+        # queue collects them, so they are handled in a single invocation
+        # after the window closes.
+        queue = Queue(
+            self,
+            "ECSQueue",
+            visibility_timeout=Duration.seconds(timeout.to_seconds() * 6),
+        )
+        lambda_func.add_event_source(
+            SqsEventSource(
+                queue,
+                batch_size=1000,
+                max_batching_window=window,
+            )
+        )
+
         Rule(
             self,
             "ECS",
@@ -381,10 +550,136 @@ class NlbStack(Stack):
                 detail_type=["ECS Task State Change"],
                 detail={
                     "clusterArn": [cluster.cluster_arn],
+                    # Only tasks of a service can be behind the NLB, and only
+                    # these states change whether a task receives traffic.
+                    "group": [{"prefix": "service:"}],
+                    "lastStatus": ["RUNNING", "STOPPED"],
                 },
                 source=["aws.ecs"],
             ),
-            targets=[LambdaFunction(lambda_func)],
+            targets=[SqsQueue(queue)],
+        )
+
+        # Events can be dropped, or their invocation can fail; the instances
+        # only fetch what is published, so publish in full every now and
+        # then to heal from that. Without a central topology, the instances
+        # do their own full scans.
+        if topology_bucket:
+            Rule(
+                self,
+                "TopologyResync",
+                schedule=Schedule.rate(resync_interval),
+                targets=[LambdaFunction(lambda_func)],
+            )
+
+    def setup_socks_proxy(self, user_data: UserData, backend: SocksBackend, workers: int) -> None:
+        user_data.add_commands(
+            "echo 'Setting up TCP and UDP SOCKS proxy'",
+            "useradd pproxy",
+            "cp /nlb/pproxy-tcp@.service /etc/systemd/system/",
+            "cp /nlb/pproxy-udp.service /etc/systemd/system/",
+            "systemctl daemon-reload",
+        )
+
+        # The services use pproxy's own UDP protocol (SOCKS5 datagrams sent
+        # straight to the proxy, without UDP ASSOCIATE), which only pproxy
+        # speaks. So UDP is always pproxy; only TCP can be something else.
+        # pproxy only sets SO_REUSEPORT on its TCP listener, so UDP is a
+        # single worker.
+        user_data.add_commands(
+            "systemctl enable pproxy-udp.service",
+            "systemctl start pproxy-udp.service",
+        )
+
+        if backend == SocksBackend.PPROXY:
+            # Every worker is a single Python process; run a few of them on
+            # the same port, so a single one is not the bottleneck.
+            for worker in range(workers):
+                user_data.add_commands(
+                    f"systemctl enable pproxy-tcp@{worker}.service",
+                    f"systemctl start pproxy-tcp@{worker}.service",
+                )
+        else:
+            user_data.add_commands(
+                "yum install 3proxy -y",
+                "cp /nlb/3proxy.cfg /etc/3proxy.cfg",
+                "systemctl enable 3proxy.service",
+                "systemctl start 3proxy.service",
+            )
+
+    def create_scaling_policies(self, auto_scaling_group: AutoScalingGroup) -> None:
+        # Scaling in removes an instance from DNS, after which the terminate
+        # Lifecycle Hook waits for the TTL and for connections to drain.
+        # Don't scale in again before that had a chance to settle.
+        cooldown = Duration.seconds(max(300, int(self.dns_ttl.to_seconds()) * 5))
+        # The launch Lifecycle Hook waits till the instance is ready.
+        warmup = Duration.seconds(180)
+
+        # A t3a.nano has a baseline bandwidth of 32 Mbit/s (4 MB/s); it can
+        # burst above it, but only for a while. Keep well below it, at 2 MB/s.
+        # Despite its name, the target is not converted: it is compared with
+        # the bytes per metric period, which is a minute with detailed
+        # monitoring.
+        auto_scaling_group.scale_on_incoming_bytes(
+            "NetworkIn",
+            target_bytes_per_second=2 * 1000 * 1000 * 60,
+            cooldown=cooldown,
+            estimated_instance_warmup=warmup,
+        )
+        auto_scaling_group.scale_on_outgoing_bytes(
+            "NetworkOut",
+            target_bytes_per_second=2 * 1000 * 1000 * 60,
+            cooldown=cooldown,
+            estimated_instance_warmup=warmup,
+        )
+
+        # Master Server and STUN traffic is many small packets, which the
+        # bytes hardly notice. These only scale out; scaling in is left to
+        # the target tracking above, so the policies don't fight.
+        for metric_name in ("NetworkPacketsIn", "NetworkPacketsOut"):
+            auto_scaling_group.scale_on_metric(
+                metric_name,
+                metric=Metric(
+                    namespace="AWS/EC2",
+                    metric_name=metric_name,
+                    dimensions={"AutoScalingGroupName": auto_scaling_group.auto_scaling_group_name},
+                    statistic="Average",
+                    period=Duration.minutes(1),
+                ),
+                # Packets per minute per instance.
+                scaling_steps=[
+                    ScalingInterval(upper=20000 * 60, change=0),
+                    ScalingInterval(lower=20000 * 60, change=+1),
+                    ScalingInterval(lower=40000 * 60, change=+2),
+                ],
+                adjustment_type=AdjustmentType.CHANGE_IN_CAPACITY,
+                cooldown=cooldown,
+                estimated_instance_warmup=warmup,
+            )
+
+        # Surplus credits are spent when an instance bursts (unlimited)
+        # beyond its CPU credits, and are paid for; spread the load when that
+        # happens. Not the credit balance itself: instances launch without
+        # credits, so every new instance would look like it ran out, and
+        # scale out again. Instances in their warmup are not counted in the
+        # average.
+        auto_scaling_group.scale_on_metric(
+            "CPUSurplusCreditBalance",
+            metric=Metric(
+                namespace="AWS/EC2",
+                metric_name="CPUSurplusCreditBalance",
+                dimensions={"AutoScalingGroupName": auto_scaling_group.auto_scaling_group_name},
+                statistic="Average",
+                period=Duration.minutes(5),
+            ),
+            scaling_steps=[
+                ScalingInterval(upper=1, change=0),
+                ScalingInterval(lower=1, upper=30, change=+1),
+                ScalingInterval(lower=30, change=+2),
+            ],
+            adjustment_type=AdjustmentType.CHANGE_IN_CAPACITY,
+            cooldown=cooldown,
+            estimated_instance_warmup=warmup,
         )
 
     def create_asg_lambda(
@@ -394,6 +689,7 @@ class NlbStack(Stack):
         vpc: IVpc,
         security_group: SecurityGroup,
         auto_scaling_group: AutoScalingGroup,
+        drain_connections: int,
     ) -> None:
         if lifecycle_transition == LifecycleTransition.INSTANCE_LAUNCHING:
             name = "Launch"
@@ -412,6 +708,8 @@ class NlbStack(Stack):
                 "HOSTED_ZONE_ID": dns.get_hosted_zone().hosted_zone_id,
                 "PRIVATE_DOMAIN_NAME": f"{self.subdomain_name}.openttd.internal",
                 "PRIVATE_HOSTED_ZONE_ID": self.private_zone.hosted_zone_id,
+                "DNS_TTL": str(int(self.dns_ttl.to_seconds())),
+                "DRAIN_CONNECTIONS": str(drain_connections),
             },
             vpc=vpc,
             security_groups=[security_group],
@@ -457,10 +755,45 @@ class NlbStack(Stack):
             )
         )
 
-    def add_nlb(self, scope: Construct, service: IEc2Service, port: Port, subdomain_name: str, description: str) -> None:
+    def add_nlb(
+        self,
+        scope: Construct,
+        service: IEc2Service,
+        port: Port,
+        subdomain_name: str,
+        description: str,
+        balance: Optional[NlbBalance] = None,
+        max_fails: Optional[int] = None,
+        fail_timeout: Optional[Duration] = None,
+        reuseport: Optional[bool] = None,
+        backlog: Optional[int] = None,
+        buffer_size: Optional[int] = None,
+        proxy_protocol: NlbProxyProtocol = NlbProxyProtocol.V1,
+        udp_stateless: bool = False,
+    ) -> None:
         port_dict = port.to_rule_json()
         Tags.of(service).add("NLB-protocol", port_dict["ipProtocol"])
         Tags.of(service).add("NLB-port", str(port_dict["fromPort"]))
+        Tags.of(service).add("NLB-proxy-protocol", proxy_protocol.value)
+        # When not set, hash (or round-robin for stateless UDP) is used.
+        if balance is not None:
+            Tags.of(service).add("NLB-balance", balance.value)
+        # Every datagram is answered by a single response, and is not
+        # related to other datagrams of the same client.
+        if udp_stateless:
+            Tags.of(service).add("NLB-udp-stateless", "true")
+        # Passive health checks; when not set, nginx's defaults are used.
+        if max_fails is not None:
+            Tags.of(service).add("NLB-max-fails", str(max_fails))
+        if fail_timeout is not None:
+            Tags.of(service).add("NLB-fail-timeout", str(int(fail_timeout.to_seconds())))
+        # Socket tuning; when not set, nginx.py picks values based on the protocol.
+        if reuseport is not None:
+            Tags.of(service).add("NLB-reuseport", "true" if reuseport else "false")
+        if backlog is not None:
+            Tags.of(service).add("NLB-backlog", str(backlog))
+        if buffer_size is not None:
+            Tags.of(service).add("NLB-buffer-size", str(buffer_size))
 
         self.create_alias(scope, subdomain_name)
 
@@ -468,8 +801,36 @@ class NlbStack(Stack):
         self.security_group.add_ingress_rule(peer=Peer.any_ipv4(), connection=port, description=f"{description} (IPv4)")
 
 
-def add_nlb(scope: Construct, service: IEc2Service, port: Port, subdomain_name: str, description: str) -> None:
+def add_nlb(
+    scope: Construct,
+    service: IEc2Service,
+    port: Port,
+    subdomain_name: str,
+    description: str,
+    balance: Optional[NlbBalance] = None,
+    max_fails: Optional[int] = None,
+    fail_timeout: Optional[Duration] = None,
+    reuseport: Optional[bool] = None,
+    backlog: Optional[int] = None,
+    buffer_size: Optional[int] = None,
+    proxy_protocol: NlbProxyProtocol = NlbProxyProtocol.V1,
+    udp_stateless: bool = False,
+) -> None:
     if g_nlb is None:
         raise Exception("No NlbStack instance exists")
 
-    return g_nlb.add_nlb(scope, service, port, subdomain_name, description)
+    return g_nlb.add_nlb(
+        scope,
+        service,
+        port,
+        subdomain_name,
+        description,
+        balance=balance,
+        max_fails=max_fails,
+        fail_timeout=fail_timeout,
+        reuseport=reuseport,
+        backlog=backlog,
+        buffer_size=buffer_size,
+        proxy_protocol=proxy_protocol,
+        udp_stateless=udp_stateless,
+    )
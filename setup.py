@@ -21,12 +21,15 @@ setuptools.setup(
     install_requires=[
         "aws-cdk.aws-certificatemanager",
         "aws-cdk.aws-cloudfront-origins",
+        "aws-cdk.aws-cloudwatch",
         "aws-cdk.aws-ecs",
         "aws-cdk.aws-elasticloadbalancingv2",
         "aws_cdk.aws_events-targets",
+        "aws-cdk.aws-lambda-event-sources",
         "aws-cdk.aws-logs",
         "aws-cdk.aws-route53",
         "aws-cdk.aws-s3",
+        "aws-cdk.aws-sqs",
         "aws-cdk.aws-ssm",
         "aws-cdk.core",
         "aws-cdk.custom-resources",
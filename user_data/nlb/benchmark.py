@@ -0,0 +1,70 @@
+"""
+Benchmark the discovery and rendering of nginx.py, without AWS.
+
+For every size, a synthetic snapshot with that many services (each with
+one task) is generated; a recorded snapshot can be benchmarked too. Per
+size the time spent in discovery and rendering is shown, together with
+the API calls the live path would have made.
+"""
+
+import argparse
+import discovery
+import nginx
+import snapshot
+import time
+
+SIZES = [10, 100, 1000]
+
+
+def benchmark(cluster_snapshot, repeat):
+    discovery_times = []
+    render_times = []
+
+    for _ in range(repeat):
+        discovery.client_ecs = snapshot.SnapshotECSClient(cluster_snapshot)
+        discovery.client_ec2 = snapshot.SnapshotEC2Client(cluster_snapshot)
+        # Every run is a cold start, as on a fresh NLB instance.
+        discovery.ec2_ip_cache.clear()
+        discovery.container_instance_cache.clear()
+
+        start = time.perf_counter()
+        container_mapping = discovery.fetch_container_mapping("snapshot")
+        load_balancer, listener_options = discovery.fetch_active_tasks("snapshot", container_mapping)
+        discovery_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        blocks = nginx.render_blocks(load_balancer, listener_options)
+        nginx.render_nginx_config(blocks, nginx.WORKER_CONNECTIONS_MIN)
+        render_times.append(time.perf_counter() - start)
+
+    calls = discovery.client_ecs.calls + discovery.client_ec2.calls
+    return min(discovery_times), min(render_times), calls
+
+
+def report(name, cluster_snapshot, repeat):
+    discovery_time, render_time, calls = benchmark(cluster_snapshot, repeat)
+
+    print(f"{name}: {len(cluster_snapshot['services'])} services, {len(cluster_snapshot['tasks'])} tasks")
+    print(f"  discovery: {discovery_time * 1000:.1f} ms")
+    print(f"  render:    {render_time * 1000:.1f} ms")
+    print(f"  API calls: {sum(calls.values())}")
+    for operation_name, count in sorted(calls.items()):
+        print(f"    {operation_name}: {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the NLB configuration generator.")
+    parser.add_argument("--snapshot", help="benchmark this (recorded) snapshot instead of the synthetic ones")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per size; the fastest run is reported")
+    args = parser.parse_args()
+
+    if args.snapshot:
+        report(args.snapshot, snapshot.load_snapshot(args.snapshot), args.repeat)
+        return
+
+    for size in SIZES:
+        report(f"synthetic-{size}", snapshot.generate_snapshot(size), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
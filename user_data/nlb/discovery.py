@@ -0,0 +1 @@
+../../lambdas/discovery-layer/python/discovery.py
\ No newline at end of file
@@ -0,0 +1,233 @@
+"""
+Export the traffic of the NLB listeners as CloudWatch metrics.
+
+The stream access-log of nginx (as configured by nginx.py) is followed, and
+every interval the sessions, bytes and upstream failures are aggregated per
+listener and per backend. These are sent as Embedded Metric Format (EMF)
+to CloudWatch Logs, which turns the listener values into metrics.
+
+The backend values are only logged (per listener, as a property of the
+document), not turned into metrics: a backend is the dynamic host-port of
+an ECS task, so every replaced task would create a new set of metrics.
+They can still be queried with CloudWatch Logs Insights.
+"""
+
+import argparse
+import boto3
+import json
+import os
+import socket
+import time
+
+from collections import defaultdict
+
+client_logs = None
+
+STREAM_LOG = "/var/log/nginx/nlb-stream.log"
+NAMESPACE = "OpenTTD/NLB"
+
+# nginx's status for a session that could not be forwarded to any upstream.
+UPSTREAM_FAILURE_STATUSES = ("502", "503", "504")
+
+LISTENER_METRICS = [
+    ("Sessions", "Count"),
+    ("BytesSent", "Bytes"),
+    ("BytesReceived", "Bytes"),
+    ("UpstreamFailures", "Count"),
+    ("SessionTime", "Seconds"),
+]
+BACKEND_VALUES = ["Sessions", "UpstreamFailures"]
+
+
+def new_counters():
+    return defaultdict(lambda: defaultdict(float))
+
+
+def parse_line(line):
+    """Parse a line of the stream access-log; None if it is not in the expected format."""
+    fields = line.split(" ", 6)
+    if len(fields) != 7:
+        return None
+
+    protocol, port, status, bytes_sent, bytes_received, session_time, upstream_addr = fields
+    try:
+        return {
+            "listener": f"{protocol.lower()}{port}",
+            "status": status,
+            "bytes_sent": int(bytes_sent),
+            "bytes_received": int(bytes_received),
+            "session_time": float(session_time),
+            # When an upstream fails, nginx tries the next; all are listed.
+            "upstreams": [upstream.strip() for upstream in upstream_addr.strip().split(",") if upstream.strip() != "-"],
+        }
+    except ValueError:
+        return None
+
+
+def aggregate(entry, listeners, backends):
+    failed = entry["status"] in UPSTREAM_FAILURE_STATUSES
+
+    listener = listeners[entry["listener"]]
+    listener["Sessions"] += 1
+    listener["BytesSent"] += entry["bytes_sent"]
+    listener["BytesReceived"] += entry["bytes_received"]
+    listener["SessionTime"] += entry["session_time"]
+    if failed:
+        listener["UpstreamFailures"] += 1
+
+    # All but the last upstream failed; the last only if the session did.
+    for index, upstream in enumerate(entry["upstreams"]):
+        backend = backends[(entry["listener"], upstream)]
+        backend["Sessions"] += 1
+        if failed or index < len(entry["upstreams"]) - 1:
+            backend["UpstreamFailures"] += 1
+
+
+def render_emf(timestamp, dimensions, metrics, values, properties):
+    document = {
+        "_aws": {
+            "Timestamp": timestamp,
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": NAMESPACE,
+                    "Dimensions": [list(dimensions)],
+                    "Metrics": [{"Name": name, "Unit": unit} for name, unit in metrics],
+                }
+            ],
+        },
+    }
+    document.update(dimensions)
+    document.update(properties)
+    for name, _ in metrics:
+        document[name] = values.get(name, 0)
+    return json.dumps(document)
+
+
+def render_events(listeners, backends):
+    timestamp = int(time.time() * 1000)
+    events = []
+
+    listener_backends = defaultdict(dict)
+    for (listener, backend), values in sorted(backends.items()):
+        listener_backends[listener][backend] = {name: values.get(name, 0) for name in BACKEND_VALUES}
+
+    for listener, values in sorted(listeners.items()):
+        # Report the average session time, not the sum.
+        values = dict(values, SessionTime=values["SessionTime"] / values["Sessions"] if values["Sessions"] else 0)
+        properties = {"Backends": listener_backends[listener]}
+        events.append(render_emf(timestamp, {"Listener": listener}, LISTENER_METRICS, values, properties))
+
+    return [{"timestamp": timestamp, "message": event} for event in events]
+
+
+def ensure_log_stream(log_group, log_stream):
+    try:
+        client_logs.create_log_stream(logGroupName=log_group, logStreamName=log_stream)
+    except client_logs.exceptions.ResourceAlreadyExistsException:
+        pass
+
+
+def put_events(log_group, log_stream, events):
+    # A single put_log_events() is limited to 10,000 events.
+    for i in range(0, len(events), 10000):
+        client_logs.put_log_events(logGroupName=log_group, logStreamName=log_stream, logEvents=events[i : i + 10000])
+
+
+class LogFollower:
+    """Follow a file like "tail -F"; it is reopened when it is rotated."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.fp = None
+        self.inode = None
+        self.buffer = ""
+
+    def open(self, seek_end):
+        try:
+            self.fp = open(self.filename, "r")
+        except FileNotFoundError:
+            self.fp = None
+            return
+
+        self.inode = os.fstat(self.fp.fileno()).st_ino
+        if seek_end:
+            self.fp.seek(0, os.SEEK_END)
+
+    def read_lines(self):
+        if self.fp is None:
+            # The file didn't exist yet or was rotated; all of it is new.
+            self.open(seek_end=False)
+            if self.fp is None:
+                return []
+
+        self.buffer += self.fp.read()
+        lines = self.buffer.split("\n")
+        self.buffer = lines.pop()
+
+        try:
+            rotated = os.stat(self.filename).st_ino != self.inode
+        except FileNotFoundError:
+            rotated = True
+        if rotated:
+            # Continue with the start of the new file on the next call.
+            self.fp.close()
+            self.fp = None
+
+        return lines
+
+
+def run(log_group, interval):
+    log_stream = socket.gethostname()
+    ensure_log_stream(log_group, log_stream)
+
+    follower = LogFollower(STREAM_LOG)
+    follower.open(seek_end=True)
+
+    while True:
+        start = time.monotonic()
+
+        listeners = new_counters()
+        backends = new_counters()
+        while time.monotonic() - start < interval:
+            for line in follower.read_lines():
+                entry = parse_line(line)
+                if entry is not None:
+                    aggregate(entry, listeners, backends)
+            time.sleep(1)
+
+        events = render_events(listeners, backends)
+        if not events:
+            continue
+
+        try:
+            put_events(log_group, log_stream, events)
+        except client_logs.exceptions.ResourceNotFoundException:
+            ensure_log_stream(log_group, log_stream)
+        except Exception as e:
+            print(f"Failed to put metrics: {e}")
+
+
+def main():
+    global client_logs
+
+    parser = argparse.ArgumentParser(description="Export the traffic of the NLB listeners to CloudWatch.")
+    parser.add_argument("--interval", type=int, default=60, help="seconds of traffic aggregated into one datapoint")
+    args = parser.parse_args()
+
+    region = os.environ.get("NLB_REGION")
+    if not region:
+        with open("/etc/.region", "r") as fp:
+            region = fp.read().strip()
+
+    log_group = os.environ.get("NLB_METRICS_LOG_GROUP")
+    if not log_group:
+        with open("/etc/.metrics-log-group", "r") as fp:
+            log_group = fp.read().strip()
+
+    client_logs = boto3.client("logs", region_name=region)
+
+    run(log_group, args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,111 +1,704 @@
+import argparse
 import boto3
+import discovery
+import hashlib
+import json
 import os
-
+import snapshot
+import subprocess
+import sys
+import tempfile
+import time
+
+from botocore.exceptions import (
+    BotoCoreError,
+    ClientError,
+)
 from collections import defaultdict
 
-client_ecs = None
-client_ec2 = None
+client_s3 = None
+
+NGINX_CONFIG = "/etc/nginx/nginx.conf"
+NLB_INCLUDE = "include /etc/nginx/nlb.d/*.conf;"
+NLB_EVENTS_INCLUDE = "include /etc/nginx/nlb.d/*.events;"
+# Read by exporter.py; mind the field order when changing the format.
+STREAM_LOG = "/var/log/nginx/nlb-stream.log"
+STREAM_LOG_FORMAT = "$protocol $server_port $status $bytes_sent $bytes_received $session_time $upstream_addr"
+READY_FILE = "/var/lib/nlb/ready.json"
+CONNECTIONS_FILE = "/var/lib/nlb/connections.json"
+# The last topology that was discovered (or fetched); used on boot to serve
+# traffic before the AWS APIs are consulted.
+TOPOLOGY_CACHE = "/var/lib/nlb/topology.json"
+# Seconds between attempts to get the topology while the AWS APIs fail.
+RESYNC_RETRY_INTERVAL = 10
+# Seconds between updates of the connections file; it is used to drain an
+# instance on termination, so it doesn't have to be very accurate.
+CONNECTIONS_INTERVAL = 5
+# TCP state "ESTABLISHED" as shown in /proc/net/tcp.
+TCP_ESTABLISHED = "01"
+
+# How each balancing policy (NLB-balance tag) is rendered in an upstream.
+BALANCE_DIRECTIVES = {
+    "hash": "hash $remote_addr;",
+    "least_conn": "least_conn;",
+    "random": "random two least_conn;",
+    "round_robin": None,  # nginx's default
+}
+# Seconds a stateless UDP session waits for its response.
+STATELESS_UDP_TIMEOUT = 5
+
+# Rough memory a single nginx connection (so either the client or the
+# upstream side of a proxied session) costs, kernel buffers included.
+CONNECTION_MEMORY = 32 * 1024
+# Part of the memory of the instance that can be spent on connections.
+CONNECTION_MEMORY_SHARE = 0.5
+WORKER_CONNECTIONS_MIN = 1024
+WORKER_CONNECTIONS_MAX = 65536
+# A UDP buffer only has to hold a single datagram; TCP uses nginx's default.
+PROXY_BUFFER_SIZE = {
+    "tcp": 16 * 1024,
+    "udp": 4 * 1024,
+}
+# When set (with --worker-connections), used instead of the calculated value.
+worker_connections_override = None
+
+
+def render_listener(listener, backends, options):
+    protocol, port = listener
+
+    # Every datagram of a stateless UDP service stands on its own; there
+    # is no reason to keep a client on the same backend.
+    stateless = protocol == "udp" and options.get("udp_stateless", False)
+
+    default_balance = "round_robin" if stateless else "hash"
+    balance = options.get("balance", default_balance)
+    if balance not in BALANCE_DIRECTIVES:
+        print(f"Unknown balancing policy '{balance}' for {protocol}{port}; using {default_balance}")
+        balance = default_balance
+
+    # Passive health checks; without them nginx uses its defaults.
+    server_parameters = ""
+    if "max_fails" in options:
+        server_parameters += f" max_fails={options['max_fails']}"
+    if "fail_timeout" in options:
+        server_parameters += f" fail_timeout={options['fail_timeout']}s"
+
+    block = f"  upstream {protocol}{port} {{\n"
+    if BALANCE_DIRECTIVES[balance]:
+        block += f"    {BALANCE_DIRECTIVES[balance]}\n"
+    for host_ip, host_port in sorted(backends):
+        block += f"    server {host_ip}:{host_port}{server_parameters};\n"
+    block += "  }\n"
+
+    listen_parameters = ""
+    if protocol != "tcp":
+        listen_parameters += f" {protocol}"
+    # With reuseport every worker gets its own socket, so bursts are spread
+    # over all workers instead of them fighting over a single one.
+    if options.get("reuseport", True):
+        listen_parameters += " reuseport"
+    if protocol == "tcp":
+        listen_parameters += f" backlog={options.get('backlog', get_listen_backlog())}"
+
+    block += "  server {\n"
+    block += f"    listen {port}{listen_parameters};\n"
+    block += f"    listen [::]:{port}{listen_parameters};\n"
+    block += f"    proxy_pass {protocol}{port};\n"
+    # nginx can only send version 1 (text) of the PROXY protocol.
+    if options.get("proxy_protocol", "v1") != "off":
+        block += "    proxy_protocol on;\n"
+    block += f"    proxy_buffer_size {options.get('buffer_size', PROXY_BUFFER_SIZE[protocol])};\n"
+    if stateless:
+        # A session ends with its response, instead of occupying a
+        # connection till the timeout.
+        block += "    proxy_requests 1;\n"
+        block += "    proxy_responses 1;\n"
+        block += f"    proxy_timeout {STATELESS_UDP_TIMEOUT}s;\n"
+    elif protocol == "udp":
+        block += "    proxy_requests 1;\n"
+        block += "    proxy_timeout 30s;\n"
+    block += "  }\n"
+
+    return block
+
+
+def get_memory_total():
+    with open("/proc/meminfo", "r") as fp:
+        for line in fp:
+            if line.startswith("MemTotal:"):
+                return int(line.split()[1]) * 1024
+    raise Exception("MemTotal not found in /proc/meminfo")
+
+
+def get_listen_backlog():
+    # A bigger backlog is silently capped by the kernel anyway.
+    with open("/proc/sys/net/core/somaxconn", "r") as fp:
+        return int(fp.read().strip())
+
+
+def calculate_worker_connections(listener_count):
+    """Calculate the connections per worker nginx can handle on this instance."""
+    if worker_connections_override:
+        return worker_connections_override
+
+    worker_count = os.cpu_count() or 1
+    connections = int(get_memory_total() * CONNECTION_MEMORY_SHARE / CONNECTION_MEMORY / worker_count)
+
+    # Listening sockets take a connection too; with reuseport that is per
+    # worker, for IPv4 and IPv6, for every listener, 443 and 80.
+    connections += (listener_count + 2) * 2
+
+    return max(WORKER_CONNECTIONS_MIN, min(connections, WORKER_CONNECTIONS_MAX))
+
+
+def render_events_config(worker_connections):
+    return f"worker_connections {worker_connections};\n"
+
+
+def render_nginx_config(blocks, worker_connections):
+    # Every connection is a file descriptor; leave some room for the rest.
+    config = f"worker_rlimit_nofile {worker_connections * 2};\n"
+    config += "\n"
+    config += "stream {\n"
+
+    config += f"  log_format nlb '{STREAM_LOG_FORMAT}';\n"
+    config += f"  access_log {STREAM_LOG} nlb buffer=64k flush=5s;\n"
+
+    # Forward all 443 traffic to the ALB.
+    config += "  upstream alb_https {\n"
+    config += "    server www.openttd.org:443;\n"
+    config += "  }\n"
+    config += "  server {\n"
+    config += "    listen 443;\n"
+    config += "    listen [::]:443;\n"
+    config += "    proxy_pass alb_https;\n"
+    config += "  }\n"
+
+    # Sorted, so the same topology always results in the same configuration.
+    for listener in sorted(blocks):
+        config += blocks[listener]
+
+    config += "}\n"
+    return config
+
+
+def render_blocks(load_balancer, listener_options):
+    # An upstream without servers is not valid for nginx; skip listeners
+    # that currently have no running tasks.
+    return {
+        listener: render_listener(listener, backends, listener_options.get(listener, {}))
+        for listener, backends in load_balancer.items()
+        if backends
+    }
+
+
+def reload_nginx():
+    os.system("systemctl reload nginx")
 
 
-def write_nginx_config(load_balancer):
-    with open("nlb.conf", "w") as fp:
-        fp.write("stream {\n")
+def validate_nginx_config(filename, events_filename):
+    # "nginx -t" can only test a full configuration; so test a copy of the
+    # main configuration that includes the candidates instead of nlb.d.
+    with open(NGINX_CONFIG, "r") as fp:
+        main_config = fp.read()
+    main_config = main_config.replace(NLB_INCLUDE, f"include {os.path.abspath(filename)};")
+    main_config = main_config.replace(NLB_EVENTS_INCLUDE, f"include {os.path.abspath(events_filename)};")
 
-        # Forward all 443 traffic to the ALB.
-        fp.write("  upstream alb_https {\n")
-        fp.write("    hash $remote_addr;\n")
-        fp.write("    server www.openttd.org:443;\n")
-        fp.write("  }\n")
-        fp.write("  server {\n")
-        fp.write("    listen 443;\n")
-        fp.write("    listen [::]:443;\n")
-        fp.write("    proxy_pass alb_https;\n")
-        fp.write("  }\n")
+    with tempfile.NamedTemporaryFile("w", suffix=".conf", delete=False) as fp:
+        fp.write(main_config)
 
-        for listener, backends in load_balancer.items():
-            protocol, port = listener
+    try:
+        result = subprocess.run(["nginx", "-t", "-q", "-c", fp.name], capture_output=True, text=True)
+    finally:
+        os.unlink(fp.name)
 
-            if protocol == "tcp":
-                protocol_if_not_tcp = ""
-            else:
-                protocol_if_not_tcp = protocol
-
-            fp.write(f"  upstream {protocol}{port} {{\n")
-            fp.write("    hash $remote_addr;\n")
-            for backend in backends:
-                host_ip, host_port = backend
-                fp.write(f"    server {host_ip}:{host_port};\n")
-            fp.write("  }\n")
-
-            fp.write("  server {\n")
-            fp.write(f"    listen {port} {protocol_if_not_tcp};\n")
-            fp.write(f"    listen [::]:{port} {protocol_if_not_tcp};\n")
-            fp.write(f"    proxy_pass {protocol}{port};\n")
-            fp.write("    proxy_protocol on;\n")
-            if protocol == "udp":
-                fp.write("    proxy_requests 1;\n")
-                fp.write("    proxy_timeout 30s;\n")
-            fp.write("  }\n")
-
-        fp.write("}\n")
+    if result.returncode != 0:
+        print(result.stderr)
+        return False
+    return True
 
-    os.system("systemctl reload nginx")
 
+def write_ready_file(upstreams):
+    """Tell the outside world (via nginx on /readyz) this instance has a valid configuration to forward traffic with."""
+    os.makedirs(os.path.dirname(READY_FILE), exist_ok=True)
 
-def fetch_container_mapping(cluster):
-    container_mapping = {}
-    containers = client_ecs.list_container_instances(cluster=cluster)
-    containers = client_ecs.describe_container_instances(
-        cluster=cluster, containerInstances=containers["containerInstanceArns"]
-    )
-    for container in containers["containerInstances"]:
-        if container["status"] != "ACTIVE":
+    with open(f"{READY_FILE}.tmp", "w") as fp:
+        json.dump({"upstreams": upstreams}, fp)
+    os.replace(f"{READY_FILE}.tmp", READY_FILE)
+
+
+def count_connections(ports):
+    """Count the established TCP connections of clients to any of the given (listen) ports."""
+    count = 0
+    for filename in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(filename, "r") as fp:
+                lines = fp.readlines()[1:]
+        except FileNotFoundError:
             continue
 
-        ec2_instances = client_ec2.describe_instances(InstanceIds=[container["ec2InstanceId"]])
-        ec2_ip = ec2_instances["Reservations"][0]["Instances"][0]["PrivateIpAddress"]
+        for line in lines:
+            fields = line.split()
+            local_port = int(fields[1].rsplit(":", 1)[1], 16)
+            if fields[3] == TCP_ESTABLISHED and local_port in ports:
+                count += 1
+    return count
 
-        container_mapping[container["containerInstanceArn"]] = ec2_ip
 
-    return container_mapping
+def write_connections_file(blocks):
+    """Tell the outside world (via nginx on /connections) how many clients are still being proxied."""
+    # UDP is connectionless, so only TCP listeners (and the ALB forward) can be drained.
+    ports = {port for protocol, port in blocks if protocol == "tcp"}
+    ports.add(443)
 
+    with open(f"{CONNECTIONS_FILE}.tmp", "w") as fp:
+        json.dump({"connections": count_connections(ports)}, fp)
+    os.replace(f"{CONNECTIONS_FILE}.tmp", CONNECTIONS_FILE)
 
-def fetch_active_tasks(cluster, container_mapping):
-    load_balancer = defaultdict(set)
 
-    services = client_ecs.list_services(cluster=cluster, maxResults=100)
-    for service in services["serviceArns"]:
-        tags = client_ecs.list_tags_for_resource(resourceArn=service)
-        tags = {tag["key"]: tag["value"] for tag in tags["tags"]}
+def is_file_unchanged(filename, content):
+    if not os.path.exists(filename):
+        return False
 
-        protocol = tags.get("NLB-protocol")
-        port = tags.get("NLB-port")
+    with open(filename, "rb") as fp:
+        return hashlib.sha256(fp.read()).digest() == hashlib.sha256(content.encode()).digest()
 
-        if not protocol or not port:
-            continue
 
-        port = int(port)
+def update_nginx_config(blocks):
+    """Write the configuration and reload nginx, but only if it changed and is valid. Returns True if nginx reloaded."""
+    worker_connections = calculate_worker_connections(len(blocks))
+    files = {
+        "nlb.conf": render_nginx_config(blocks, worker_connections),
+        "nlb.events": render_events_config(worker_connections),
+    }
 
-        tasks = client_ecs.list_tasks(cluster=cluster, serviceName=service)
-        tasks = client_ecs.describe_tasks(cluster=cluster, tasks=tasks["taskArns"])
+    if all(is_file_unchanged(filename, content) for filename, content in files.items()):
+        write_ready_file(len(blocks))
+        return False
 
-        for task in tasks["tasks"]:
-            if task["lastStatus"] != "RUNNING" or task["desiredStatus"] != "RUNNING":
-                continue
+    # The ".tmp" suffix keeps the candidates out of the "nlb.d/*.conf" and
+    # "nlb.d/*.events" includes.
+    for filename, content in files.items():
+        with open(f"{filename}.tmp", "w") as fp:
+            fp.write(content)
+            fp.flush()
+            os.fsync(fp.fileno())
 
-            container_instance = task["containerInstanceArn"]
-            for container in task["containers"]:
-                for network_binding in container["networkBindings"]:
-                    if network_binding["containerPort"] == port:
-                        host_port = network_binding["hostPort"]
+    if not validate_nginx_config("nlb.conf.tmp", "nlb.events.tmp"):
+        print("ERROR: generated nginx configuration is invalid; keeping the current one")
+        for filename in files:
+            os.unlink(f"{filename}.tmp")
+        return False
 
-                        load_balancer[(protocol, port)].add((container_mapping.get(container_instance), host_port))
+    # Atomic, so nginx never sees a half-written configuration.
+    for filename in files:
+        os.replace(f"{filename}.tmp", filename)
+    reload_nginx()
+    write_ready_file(len(blocks))
+    return True
 
+
+def write_nginx_config(load_balancer, listener_options):
+    update_nginx_config(render_blocks(load_balancer, listener_options))
+
+
+def get_changed_listeners(old_load_balancer, new_load_balancer):
+    return {
+        listener
+        for listener in set(old_load_balancer) | set(new_load_balancer)
+        if old_load_balancer.get(listener) != new_load_balancer.get(listener)
+    }
+
+
+def artifact_to_load_balancer(artifact):
+    load_balancer = defaultdict(set)
+    for listener in artifact["listeners"]:
+        load_balancer[(listener["protocol"], listener["port"])] = {
+            (host_ip, host_port) for host_ip, host_port in listener["backends"]
+        }
     return load_balancer
 
 
+def artifact_to_listener_options(artifact):
+    return {(listener["protocol"], listener["port"]): listener.get("options", {}) for listener in artifact["listeners"]}
+
+
+def fetch_artifact(topology_url):
+    """Fetch the topology as published by the nlb-ecs Lambda; None if it was never published."""
+    bucket, _, key = topology_url[len("s3://") :].partition("/")
+
+    try:
+        response = client_s3.get_object(Bucket=bucket, Key=key)
+    except client_s3.exceptions.NoSuchKey:
+        return None
+
+    return json.loads(response["Body"].read())
+
+
+def load_topology_cache():
+    """Load the last-known-good topology; None if there is none."""
+    try:
+        with open(TOPOLOGY_CACHE, "r") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+def save_topology_cache(load_balancer, listener_options, mirror_url):
+    """Store the topology as last-known-good, and mirror it to S3 (if set) for new instances to boot from."""
+    artifact = discovery.load_balancer_to_artifact(load_balancer, listener_options, int(time.time() * 1000))
+
+    cache = load_topology_cache()
+    if cache is not None and cache["listeners"] == artifact["listeners"]:
+        return
+
+    os.makedirs(os.path.dirname(TOPOLOGY_CACHE), exist_ok=True)
+    with open(f"{TOPOLOGY_CACHE}.tmp", "w") as fp:
+        json.dump(artifact, fp)
+    os.replace(f"{TOPOLOGY_CACHE}.tmp", TOPOLOGY_CACHE)
+
+    if mirror_url:
+        bucket, _, key = mirror_url[len("s3://") :].partition("/")
+        try:
+            client_s3.put_object(
+                Bucket=bucket, Key=key, Body=json.dumps(artifact).encode(), ContentType="application/json"
+            )
+        except (BotoCoreError, ClientError) as e:
+            print(f"Failed to mirror the topology to {mirror_url}: {e}")
+
+
+class Topology:
+    """
+    In-memory view of which task serves which NLB listener.
+
+    It is built with a full scan of the cluster, after which it is kept
+    up-to-date by applying the "ECS Task State Change" events as delivered
+    by the nlb-ecs Lambda.
+    """
+
+    def __init__(self, cluster):
+        self.cluster = cluster
+        self.container_mapping = {}
+        self.services = {}  # service-name -> (listener, options) (or None)
+        self.tasks = {}  # task-arn -> (listener, backends)
+        self.versions = {}  # task-arn -> version of the last applied event
+
+    def load_balancer(self):
+        load_balancer = defaultdict(set)
+        for listener, backends in self.tasks.values():
+            load_balancer[listener].update(backends)
+        return load_balancer
+
+    def listener_options(self):
+        return discovery.get_services_listener_options(self.services)
+
+    def resync(self):
+        """Rebuild the topology from a full scan; returns the listeners that changed."""
+        old_load_balancer = self.load_balancer()
+        old_listener_options = self.listener_options()
+
+        self.container_mapping = discovery.fetch_container_mapping(self.cluster)
+        self.services = discovery.fetch_services(self.cluster)
+        self.tasks = {}
+        self.versions = {}
+
+        for listener, task in discovery.fetch_tasks(self.cluster, self.services):
+            self.tasks[task["taskArn"]] = (
+                listener,
+                discovery.get_task_backends(task, listener[1], self.container_mapping),
+            )
+
+        return get_changed_listeners(old_load_balancer, self.load_balancer()) | get_changed_listeners(
+            old_listener_options, self.listener_options()
+        )
+
+    def apply_task(self, task):
+        """Apply a single task change; returns the listeners that changed."""
+        group = task.get("group", "")
+        if not group.startswith("service:"):
+            return set()
+
+        service_name = group[len("service:") :]
+        dirty = set()
+        if service_name not in self.services:
+            # A service we haven't seen before; most likely a new deployment,
+            # which might come with other options for the listener.
+            self.services[service_name] = discovery.describe_services(self.cluster, [service_name]).get(service_name)
+            if self.services[service_name] is not None:
+                dirty.add(self.services[service_name][0])
+
+        if self.services[service_name] is None:
+            return set()
+        listener, _ = self.services[service_name]
+
+        # Events can arrive out-of-order; never let an older event undo a newer one.
+        task_arn = task["taskArn"]
+        version = task.get("version", 0)
+        if version < self.versions.get(task_arn, 0):
+            return dirty
+        self.versions[task_arn] = version
+
+        if task.get("containerInstanceArn") not in self.container_mapping:
+            self.container_mapping = discovery.fetch_container_mapping(self.cluster)
+
+        backends = discovery.get_task_backends(task, listener[1], self.container_mapping)
+        _, old_backends = self.tasks.get(task_arn, (listener, set()))
+
+        if backends:
+            self.tasks[task_arn] = (listener, backends)
+        else:
+            self.tasks.pop(task_arn, None)
+
+        if backends == old_backends:
+            return dirty
+        return {listener}
+
+
+class TopologyNotPublished(Exception):
+    """The nlb-ecs Lambda did not publish a topology (yet)."""
+
+
+class ArtifactTopology:
+    """
+    The topology as published by the nlb-ecs Lambda.
+
+    The Lambda does the discovery once for all NLB instances, and tells them
+    via the spool folder when there is a new version to fetch.
+    """
+
+    def __init__(self, topology_url):
+        self.topology_url = topology_url
+        self.version = 0
+        self._load_balancer = defaultdict(set)
+        self._listener_options = {}
+
+    def load_balancer(self):
+        return self._load_balancer
+
+    def listener_options(self):
+        return self._listener_options
+
+    def resync(self):
+        """Fetch the latest published topology; returns the listeners that changed."""
+        artifact = fetch_artifact(self.topology_url)
+        # Nothing to sync with; an empty topology would replace whatever is
+        # served from the cache.
+        if artifact is None:
+            raise TopologyNotPublished(f"No topology published at {self.topology_url}")
+        if artifact["version"] <= self.version:
+            return set()
+
+        old_load_balancer = self._load_balancer
+        old_listener_options = self._listener_options
+        self._load_balancer = artifact_to_load_balancer(artifact)
+        self._listener_options = artifact_to_listener_options(artifact)
+        self.version = artifact["version"]
+
+        return get_changed_listeners(old_load_balancer, self._load_balancer) | get_changed_listeners(
+            old_listener_options, self._listener_options
+        )
+
+    def apply_task(self, task):
+        # Task changes are already part of the published topology.
+        return set()
+
+
+def read_spool(spool_folder):
+    """Read (and remove) all messages from the spool folder, oldest first."""
+    messages = []
+
+    for filename in sorted(os.listdir(spool_folder)):
+        if not filename.endswith(".json"):
+            continue
+
+        path = os.path.join(spool_folder, filename)
+        try:
+            with open(path, "r") as fp:
+                messages.append(json.load(fp))
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable message {filename}: {e}")
+        os.unlink(path)
+
+    return messages
+
+
+class Daemon:
+    """
+    Keeps the nginx configuration in sync with the topology.
+
+    boot() serves the last-known-good topology; after that, every step()
+    handles what arrived in the spool folder, resyncs when it is time, and
+    renders what changed.
+    """
+
+    def __init__(self, topology, spool_folder, resync_interval, mirror_url):
+        self.topology = topology
+        self.spool_folder = spool_folder
+        self.resync_interval = resync_interval
+        self.mirror_url = mirror_url
+
+        self.blocks = {}
+        self.synced = False
+        self.dirty = set()
+        self.force_render = True
+        self.last_resync = None
+        self.last_connections = 0
+
+    def boot(self):
+        os.makedirs(self.spool_folder, exist_ok=True)
+
+        # Serve the last-known-good topology right away; the AWS APIs might be
+        # slow or failing, and the topology is reconciled with them below.
+        cache = load_topology_cache()
+        if cache is not None:
+            self.blocks = render_blocks(artifact_to_load_balancer(cache), artifact_to_listener_options(cache))
+            update_nginx_config(self.blocks)
+
+    def step(self):
+        topology = self.topology
+
+        if self.last_resync is None:
+            resync = True
+        elif self.synced:
+            resync = time.monotonic() - self.last_resync > self.resync_interval
+        else:
+            resync = time.monotonic() - self.last_resync > RESYNC_RETRY_INTERVAL
+
+        for message in read_spool(self.spool_folder):
+            # A new published topology is fetched as part of a resync.
+            if message.get("resync") or message.get("topology"):
+                resync = True
+            # Till the first resync, changes are part of that resync.
+            if not self.synced:
+                continue
+
+            for task in message.get("events", []):
+                try:
+                    self.dirty |= topology.apply_task(task)
+                except (BotoCoreError, ClientError) as e:
+                    print(f"Failed to apply task change; resyncing: {e}")
+                    resync = True
+
+        if resync:
+            try:
+                changed = topology.resync()
+            except (BotoCoreError, ClientError, TopologyNotPublished) as e:
+                print(f"Failed to resync the topology; keeping the current one: {e}")
+            else:
+                if self.synced:
+                    self.dirty |= changed
+                else:
+                    # Whatever was rendered from the cache is replaced as a whole.
+                    self.blocks = render_blocks(topology.load_balancer(), topology.listener_options())
+                    self.force_render = True
+                    self.synced = True
+            self.last_resync = time.monotonic()
+
+        if self.synced and (self.dirty or self.force_render):
+            # Only the upstreams that changed are rendered again.
+            load_balancer = topology.load_balancer()
+            listener_options = topology.listener_options()
+            for listener in self.dirty:
+                if load_balancer.get(listener):
+                    self.blocks[listener] = render_listener(
+                        listener, load_balancer[listener], listener_options.get(listener, {})
+                    )
+                else:
+                    self.blocks.pop(listener, None)
+            self.dirty = set()
+            self.force_render = False
+
+            if update_nginx_config(self.blocks):
+                print("Topology changed; nginx reloaded")
+            save_topology_cache(load_balancer, listener_options, self.mirror_url)
+
+        if time.monotonic() - self.last_connections > CONNECTIONS_INTERVAL:
+            write_connections_file(self.blocks)
+            self.last_connections = time.monotonic()
+
+
+def run_daemon(topology, spool_folder, poll_interval, resync_interval, mirror_url):
+    daemon = Daemon(topology, spool_folder, resync_interval, mirror_url)
+    daemon.boot()
+
+    while True:
+        daemon.step()
+        time.sleep(poll_interval)
+
+
+def write_boot_config(cluster, topology_url, mirror_url):
+    """
+    Write the configuration to start nginx with.
+
+    This runs on boot, before nginx starts; any topology is better than
+    none, as the daemon reconciles it shortly after. So prefer what is
+    quick to get over what is most recent.
+    """
+    artifact = load_topology_cache()
+    for url in (topology_url, mirror_url):
+        if artifact is None and url:
+            try:
+                artifact = fetch_artifact(url)
+            except (BotoCoreError, ClientError) as e:
+                print(f"Failed to fetch the topology from {url}: {e}")
+
+    if artifact is not None:
+        write_nginx_config(artifact_to_load_balancer(artifact), artifact_to_listener_options(artifact))
+        return
+
+    # Without any known topology, do the discovery ourselves.
+    container_mapping = discovery.fetch_container_mapping(cluster)
+    load_balancer, listener_options = discovery.fetch_active_tasks(cluster, container_mapping)
+    write_nginx_config(load_balancer, listener_options)
+    save_topology_cache(load_balancer, listener_options, mirror_url)
+
+
 def main():
-    global client_ec2, client_ecs
+    global client_s3, worker_connections_override
+
+    parser = argparse.ArgumentParser(description="Generate the nginx configuration of the NLB.")
+    parser.add_argument(
+        "--daemon", action="store_true", help="keep running, and apply task changes as they arrive in the spool folder"
+    )
+    parser.add_argument(
+        "--spool-folder", default="/var/spool/nlb", help="folder the nlb-ecs Lambda delivers changes in"
+    )
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="seconds between checks of the spool folder")
+    parser.add_argument(
+        "--worker-connections",
+        type=int,
+        default=0,
+        help="connections per nginx worker (default: calculated from the memory and CPUs of the instance)",
+    )
+    parser.add_argument(
+        "--resync-interval",
+        type=int,
+        default=300,
+        help="seconds between full scans of the cluster (or fetches of the published topology)",
+    )
+    parser.add_argument(
+        "--snapshot",
+        help="discover from a cluster snapshot instead of AWS, and print the configuration instead of applying it",
+    )
+    parser.add_argument("--record-snapshot", help="record a snapshot of the cluster to this file, and exit")
+    args = parser.parse_args()
+
+    worker_connections_override = args.worker_connections
+
+    if args.snapshot:
+        cluster_snapshot = snapshot.load_snapshot(args.snapshot)
+        discovery.client_ecs = snapshot.SnapshotECSClient(cluster_snapshot)
+        discovery.client_ec2 = snapshot.SnapshotEC2Client(cluster_snapshot)
+
+        container_mapping = discovery.fetch_container_mapping("snapshot")
+        load_balancer, listener_options = discovery.fetch_active_tasks("snapshot", container_mapping)
+        blocks = render_blocks(load_balancer, listener_options)
+        print(render_nginx_config(blocks, calculate_worker_connections(len(blocks))), end="")
+
+        # The API calls the live path would have made.
+        for operation_name, count in sorted((discovery.client_ecs.calls + discovery.client_ec2.calls).items()):
+            print(f"{operation_name}: {count}", file=sys.stderr)
+        return
 
     region = os.environ.get("NLB_REGION")
     if not region:
@@ -117,13 +710,38 @@ def main():
         with open("/etc/.cluster", "r") as fp:
             cluster = fp.read().strip()
 
-    client_ecs = boto3.client("ecs", region_name=region)
-    client_ec2 = boto3.client("ec2", region_name=region)
-
-    container_mapping = fetch_container_mapping(cluster)
-    load_balancer = fetch_active_tasks(cluster, container_mapping)
-
-    write_nginx_config(load_balancer)
+    # When set, the topology is published centrally by the nlb-ecs Lambda.
+    topology_url = os.environ.get("NLB_TOPOLOGY_URL")
+    if not topology_url and os.path.exists("/etc/.topology-url"):
+        with open("/etc/.topology-url", "r") as fp:
+            topology_url = fp.read().strip()
+
+    # Without a central topology, the instances share their last-known-good
+    # topology here, so new instances can boot from it.
+    mirror_url = os.environ.get("NLB_TOPOLOGY_MIRROR_URL")
+    if not mirror_url and os.path.exists("/etc/.topology-mirror-url"):
+        with open("/etc/.topology-mirror-url", "r") as fp:
+            mirror_url = fp.read().strip()
+
+    discovery.setup(region)
+    client_s3 = boto3.client("s3", region_name=region)
+
+    if args.record_snapshot:
+        snapshot.save_snapshot(
+            snapshot.record_snapshot(discovery.client_ecs, discovery.client_ec2, cluster), args.record_snapshot
+        )
+        return
+
+    if args.daemon:
+        if topology_url:
+            topology = ArtifactTopology(topology_url)
+        else:
+            topology = Topology(cluster)
+
+        run_daemon(topology, args.spool_folder, args.poll_interval, args.resync_interval, mirror_url)
+        return
+
+    write_boot_config(cluster, topology_url, mirror_url)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,257 @@
+"""
+Offline stand-ins for the ECS and EC2 clients nginx.py uses.
+
+A snapshot is a JSON file with the services (and their tags), tasks,
+container instances and EC2 instances of a cluster. It can be recorded
+from a live cluster (nginx.py --record-snapshot), or generated (see
+generate_snapshot()). The clients answer from the snapshot, and count the
+API calls the live path would have made; pages are as big as AWS makes
+them, so the counts match what a real cluster would see.
+"""
+
+import json
+
+from collections import Counter
+
+# Page-size of the paginated calls, as AWS uses them.
+PAGE_SIZES = {
+    "list_services": 10,
+    "list_tasks": 100,
+    "list_container_instances": 100,
+    "describe_instances": 1000,
+    # Not used by nginx.py, but by the nlb-ecs Lambda; for harness/nlb.py.
+    "list_command_invocations": 50,
+}
+
+
+def load_snapshot(filename):
+    with open(filename, "r") as fp:
+        return json.load(fp)
+
+
+def save_snapshot(snapshot, filename):
+    with open(filename, "w") as fp:
+        json.dump(snapshot, fp, indent=2, sort_keys=True)
+
+
+def record_snapshot(client_ecs, client_ec2, cluster):
+    """Record a snapshot from a live cluster."""
+    service_arns = []
+    for page in client_ecs.get_paginator("list_services").paginate(cluster=cluster):
+        service_arns.extend(page["serviceArns"])
+
+    services = []
+    for i in range(0, len(service_arns), 10):
+        response = client_ecs.describe_services(cluster=cluster, services=service_arns[i : i + 10], include=["TAGS"])
+        services.extend(
+            {"serviceName": service["serviceName"], "tags": service.get("tags", [])} for service in response["services"]
+        )
+
+    task_arns = []
+    for page in client_ecs.get_paginator("list_tasks").paginate(cluster=cluster):
+        task_arns.extend(page["taskArns"])
+
+    tasks = []
+    for i in range(0, len(task_arns), 100):
+        tasks.extend(client_ecs.describe_tasks(cluster=cluster, tasks=task_arns[i : i + 100])["tasks"])
+
+    container_instance_arns = []
+    for page in client_ecs.get_paginator("list_container_instances").paginate(cluster=cluster):
+        container_instance_arns.extend(page["containerInstanceArns"])
+
+    container_instances = []
+    for i in range(0, len(container_instance_arns), 100):
+        response = client_ecs.describe_container_instances(
+            cluster=cluster, containerInstances=container_instance_arns[i : i + 100]
+        )
+        container_instances.extend(response["containerInstances"])
+
+    instances = []
+    instance_ids = [container_instance["ec2InstanceId"] for container_instance in container_instances]
+    if instance_ids:
+        for page in client_ec2.get_paginator("describe_instances").paginate(InstanceIds=instance_ids):
+            for reservation in page["Reservations"]:
+                instances.extend(reservation["Instances"])
+
+    return {
+        "services": services,
+        "tasks": [
+            {
+                "taskArn": task["taskArn"],
+                "group": task.get("group", ""),
+                "lastStatus": task["lastStatus"],
+                "desiredStatus": task["desiredStatus"],
+                "containerInstanceArn": task.get("containerInstanceArn"),
+                "containers": [
+                    {"networkBindings": container.get("networkBindings", [])} for container in task["containers"]
+                ],
+            }
+            for task in tasks
+        ],
+        "containerInstances": [
+            {
+                "containerInstanceArn": container_instance["containerInstanceArn"],
+                "ec2InstanceId": container_instance["ec2InstanceId"],
+                "status": container_instance["status"],
+            }
+            for container_instance in container_instances
+        ],
+        "instances": [
+            {"InstanceId": instance["InstanceId"], "PrivateIpAddress": instance.get("PrivateIpAddress")}
+            for instance in instances
+        ],
+    }
+
+
+def generate_snapshot(service_count, tasks_per_service=1, container_instance_count=None):
+    """Generate a synthetic snapshot; every service is behind the NLB on its own port."""
+    if container_instance_count is None:
+        container_instance_count = max(1, service_count // 10)
+
+    container_instances = [
+        {
+            "containerInstanceArn": f"arn:aws:ecs:eu-central-1:0:container-instance/snapshot/{i}",
+            "ec2InstanceId": f"i-{i:017x}",
+            "status": "ACTIVE",
+        }
+        for i in range(container_instance_count)
+    ]
+    instances = [
+        {"InstanceId": f"i-{i:017x}", "PrivateIpAddress": f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"}
+        for i in range(container_instance_count)
+    ]
+
+    services = []
+    tasks = []
+    for i in range(service_count):
+        service_name = f"service-{i}"
+        services.append(
+            {
+                "serviceName": service_name,
+                "tags": [
+                    {"key": "NLB-protocol", "value": "tcp"},
+                    {"key": "NLB-port", "value": str(10000 + i)},
+                ],
+            }
+        )
+
+        for j in range(tasks_per_service):
+            tasks.append(
+                {
+                    "taskArn": f"arn:aws:ecs:eu-central-1:0:task/snapshot/{i}-{j}",
+                    "group": f"service:{service_name}",
+                    "lastStatus": "RUNNING",
+                    "desiredStatus": "RUNNING",
+                    "containerInstanceArn": container_instances[(i + j) % container_instance_count][
+                        "containerInstanceArn"
+                    ],
+                    "containers": [
+                        {
+                            "networkBindings": [
+                                {"containerPort": 10000 + i, "hostPort": 32768 + (i * tasks_per_service + j) % 28000}
+                            ]
+                        }
+                    ],
+                }
+            )
+
+    return {
+        "services": services,
+        "tasks": tasks,
+        "containerInstances": container_instances,
+        "instances": instances,
+    }
+
+
+class SnapshotPaginator:
+    def __init__(self, client, operation_name, items, result_key):
+        self.client = client
+        self.operation_name = operation_name
+        self.items = items
+        self.result_key = result_key
+
+    def paginate(self, **kwargs):
+        items = self.items(**kwargs)
+        page_size = PAGE_SIZES[self.operation_name]
+
+        # Even an empty result is a call.
+        for i in range(0, max(len(items), 1), page_size):
+            self.client.calls[self.operation_name] += 1
+            yield {self.result_key: items[i : i + page_size]}
+
+
+class SnapshotECSClient:
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.calls = Counter()
+
+    def get_paginator(self, operation_name):
+        if operation_name == "list_services":
+            return SnapshotPaginator(
+                self,
+                operation_name,
+                lambda **kwargs: [
+                    f"arn:aws:ecs:::service/{service['serviceName']}" for service in self.snapshot["services"]
+                ],
+                "serviceArns",
+            )
+        if operation_name == "list_tasks":
+            return SnapshotPaginator(self, operation_name, self._list_tasks, "taskArns")
+        if operation_name == "list_container_instances":
+            return SnapshotPaginator(self, operation_name, self._list_container_instances, "containerInstanceArns")
+        raise NotImplementedError(operation_name)
+
+    def _list_tasks(self, serviceName=None, **kwargs):
+        return [
+            task["taskArn"]
+            for task in self.snapshot["tasks"]
+            if serviceName is None or task["group"] == f"service:{serviceName}"
+        ]
+
+    def _list_container_instances(self, status=None, **kwargs):
+        return [
+            container_instance["containerInstanceArn"]
+            for container_instance in self.snapshot["containerInstances"]
+            if status is None or container_instance["status"] == status
+        ]
+
+    def describe_services(self, services, **kwargs):
+        self.calls["describe_services"] += 1
+        names = {service.split("/")[-1] for service in services}
+        return {"services": [service for service in self.snapshot["services"] if service["serviceName"] in names]}
+
+    def describe_tasks(self, tasks, **kwargs):
+        self.calls["describe_tasks"] += 1
+        task_arns = set(tasks)
+        return {"tasks": [task for task in self.snapshot["tasks"] if task["taskArn"] in task_arns]}
+
+    def describe_container_instances(self, containerInstances, **kwargs):
+        self.calls["describe_container_instances"] += 1
+        arns = set(containerInstances)
+        return {
+            "containerInstances": [
+                container_instance
+                for container_instance in self.snapshot["containerInstances"]
+                if container_instance["containerInstanceArn"] in arns
+            ]
+        }
+
+
+class SnapshotEC2Client:
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.calls = Counter()
+
+    def get_paginator(self, operation_name):
+        if operation_name == "describe_instances":
+            return SnapshotPaginator(self, operation_name, self._describe_instances, "Reservations")
+        raise NotImplementedError(operation_name)
+
+    def _describe_instances(self, InstanceIds=None, **kwargs):
+        instances = [
+            instance
+            for instance in self.snapshot["instances"]
+            if InstanceIds is None or instance["InstanceId"] in InstanceIds
+        ]
+        # One reservation per instance keeps the paging per instance.
+        return [{"Instances": [instance]} for instance in instances]
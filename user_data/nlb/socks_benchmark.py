@@ -0,0 +1,181 @@
+"""
+Benchmark a SOCKS5 proxy, as used for egress of the ECS services.
+
+Runs a local TCP and UDP echo server, and measures through the proxy:
+- TCP: connections per second (connect, send, receive the echo, close).
+- UDP: datagrams per second (send, receive the echo).
+
+UDP uses pproxy's protocol (SOCKS5 datagrams sent straight to the proxy
+port), as that is what the services use; "--udp-mode associate" uses a
+regular SOCKS5 UDP ASSOCIATE instead, for proxies that only speak that.
+
+Example, on an NLB instance:
+  python3 socks_benchmark.py --proxy 127.0.0.1:8080
+"""
+
+import argparse
+import socket
+import struct
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+def run_tcp_echo_server(sock):
+    def handle(connection):
+        with connection:
+            while True:
+                data = connection.recv(4096)
+                if not data:
+                    return
+                connection.sendall(data)
+
+    while True:
+        connection, _ = sock.accept()
+        threading.Thread(target=handle, args=(connection,), daemon=True).start()
+
+
+def run_udp_echo_server(sock):
+    while True:
+        data, address = sock.recvfrom(65536)
+        sock.sendto(data, address)
+
+
+def start_echo_servers(host):
+    tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    tcp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    tcp_sock.bind((host, 0))
+    tcp_sock.listen(1024)
+    threading.Thread(target=run_tcp_echo_server, args=(tcp_sock,), daemon=True).start()
+
+    udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udp_sock.bind((host, 0))
+    threading.Thread(target=run_udp_echo_server, args=(udp_sock,), daemon=True).start()
+
+    return tcp_sock.getsockname()[1], udp_sock.getsockname()[1]
+
+
+def socks5_address(host, port):
+    return b"\x01" + socket.inet_aton(host) + struct.pack(">H", port)
+
+
+def socks5_handshake(sock, command, host, port):
+    """Do a SOCKS5 handshake (without authentication); returns the address the proxy bound to."""
+    sock.sendall(b"\x05\x01\x00")
+    if sock.recv(2) != b"\x05\x00":
+        raise Exception("SOCKS5 proxy refused the handshake")
+
+    sock.sendall(b"\x05" + command + b"\x00" + socks5_address(host, port))
+    reply = sock.recv(10)
+    if len(reply) < 10 or reply[1] != 0:
+        raise Exception("SOCKS5 proxy refused the request")
+
+    return socket.inet_ntoa(reply[4:8]), struct.unpack(">H", reply[8:10])[0]
+
+
+def tcp_connection(proxy, host, port):
+    with socket.create_connection(proxy, timeout=5) as sock:
+        socks5_handshake(sock, b"\x01", host, port)
+        sock.sendall(b"ping")
+        if sock.recv(4) != b"ping":
+            raise Exception("Echo mismatch")
+
+
+def benchmark_tcp(proxy, host, port, duration, concurrency):
+    deadline = time.monotonic() + duration
+
+    def worker():
+        count = 0
+        errors = 0
+        while time.monotonic() < deadline:
+            try:
+                tcp_connection(proxy, host, port)
+                count += 1
+            except Exception:
+                errors += 1
+        return count, errors
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: worker(), range(concurrency)))
+
+    return sum(count for count, _ in results) / duration, sum(errors for _, errors in results)
+
+
+def benchmark_udp(proxy, host, port, duration, concurrency, udp_mode):
+    deadline = time.monotonic() + duration
+    header = b"\x00\x00\x00" + socks5_address(host, port)
+
+    def worker():
+        control = None
+        relay = proxy
+        if udp_mode == "associate":
+            # The association lives as long as this TCP connection.
+            control = socket.create_connection(proxy, timeout=5)
+            relay = socks5_handshake(control, b"\x03", "0.0.0.0", 0)
+            if relay[0] == "0.0.0.0":
+                relay = (proxy[0], relay[1])
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(1)
+
+        count = 0
+        errors = 0
+        while time.monotonic() < deadline:
+            try:
+                sock.sendto(header + b"ping", relay)
+                data, _ = sock.recvfrom(65536)
+                if not data.endswith(b"ping"):
+                    raise Exception("Echo mismatch")
+                count += 1
+            except Exception:
+                errors += 1
+
+        sock.close()
+        if control:
+            control.close()
+        return count, errors
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: worker(), range(concurrency)))
+
+    return sum(count for count, _ in results) / duration, sum(errors for _, errors in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a SOCKS5 proxy for TCP connections and UDP datagrams.")
+    parser.add_argument("--proxy", default="127.0.0.1:8080", help="host:port of the SOCKS5 proxy")
+    parser.add_argument("--udp-proxy", help="host:port of the UDP SOCKS5 proxy (default: same as --proxy)")
+    parser.add_argument(
+        "--echo-host", default="127.0.0.1", help="address the echo servers listen on; must be reachable by the proxy"
+    )
+    parser.add_argument("--duration", type=int, default=10, help="seconds per benchmark")
+    parser.add_argument("--concurrency", type=int, default=16, help="parallel clients")
+    parser.add_argument("--udp-mode", choices=["pproxy", "associate"], default="pproxy", help="how UDP is proxied")
+    parser.add_argument("--skip-tcp", action="store_true", help="only benchmark UDP")
+    parser.add_argument("--skip-udp", action="store_true", help="only benchmark TCP")
+    args = parser.parse_args()
+
+    host, _, port = args.proxy.rpartition(":")
+    proxy = (host, int(port))
+    if args.udp_proxy:
+        host, _, port = args.udp_proxy.rpartition(":")
+        udp_proxy = (host, int(port))
+    else:
+        udp_proxy = proxy
+
+    tcp_port, udp_port = start_echo_servers(args.echo_host)
+
+    if not args.skip_tcp:
+        rate, errors = benchmark_tcp(proxy, args.echo_host, tcp_port, args.duration, args.concurrency)
+        print(f"TCP: {rate:.0f} connections/s ({errors} errors)")
+
+    if not args.skip_udp:
+        rate, errors = benchmark_udp(
+            udp_proxy, args.echo_host, udp_port, args.duration, args.concurrency, args.udp_mode
+        )
+        print(f"UDP: {rate:.0f} datagrams/s ({errors} errors)")
+
+
+if __name__ == "__main__":
+    main()